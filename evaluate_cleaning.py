@@ -241,10 +241,11 @@ if __name__ == '__main__':
                     dl = D[0]*T[0] + D[1]*T[1]
                     dp = D[0]*T[1] - D[1]*T[0]
 
-                    for pe, pp in zip(signal[abs(dl) > 1*hillas[k].length],
-                                      dp[abs(dl) > 1*hillas[k].length]):
-
-                        pe_vs_dp[k].fill([np.log10(sum_p), pp], pe)
+                    outside = abs(dl) > 1*hillas[k].length
+                    pe_vs_dp[k].fill_many(
+                        [np.full(np.count_nonzero(outside), np.log10(sum_p)),
+                         dp[outside]],
+                        signal[outside])
 
                 '''
                 do some plotting '''
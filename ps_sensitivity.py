@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import glob
+import multiprocessing
 import numpy as np
 
 # pandas data frames
@@ -121,7 +122,8 @@ def correct_off_angle(data, origin=None):
     data["off_angle"] = off_angles.to(u.deg)
 
 
-def calculate_sensitivities(events, energy_bin_edges, alpha, n_draws=1):
+def make_sensitivity_calculator(events):
+    """sets up a `SensitivityPointSource` for `events` and generates the event weights"""
     SensCalc = SensitivityPointSource(
         reco_energies={'g': events['g']['MC_Energy'].values * u.TeV,
                        'p': events['p']['MC_Energy'].values * u.TeV,
@@ -151,6 +153,12 @@ def calculate_sensitivities(events, energy_bin_edges, alpha, n_draws=1):
                          'p': meta_proton["gen_gamma"],
                          'e': meta_electr["gen_gamma"]})
 
+    return SensCalc
+
+
+def calculate_sensitivities(events, energy_bin_edges, alpha, n_draws=1):
+    SensCalc = make_sensitivity_calculator(events)
+
     SensCalc.get_sensitivity(
         alpha=alpha, n_draws=n_draws, max_background_ratio=.05,
         sensitivity_energy_bin_edges=sensitivity_energy_bin_edges)
@@ -183,30 +191,249 @@ def cut_and_sensitivity(cuts, events, energy_bin_edges, alpha):
         return 1
 
 
-def get_optimal_splines(events, optimise_bin_edges, k=1):
+def li_ma_significance(n_on, n_off, alpha):
+    """significance of an excess after Li & Ma (1983), eq. 17; works on arrays"""
+    n_sum = n_on + n_off
+    with np.errstate(divide="ignore", invalid="ignore"):
+        term_on = np.where(n_on > 0,
+                           n_on * np.log((1 + alpha) / alpha * n_on / n_sum), 0)
+        term_off = np.where(n_off > 0,
+                            n_off * np.log((1 + alpha) * n_off / n_sum), 0)
+    return np.sqrt(2 * np.clip(term_on + term_off, 0, None))
+
+
+class CumulativeSensitivity:
+    """answers "what is the sensitivity for the cuts gammaness > g and off_angle < xi"
+    for every energy bin without touching the events again
+
+    the spectral weights of the events are computed only once; then, for every energy
+    bin, the weighted events are filled into 2D histograms over gammaness and off-angle
+    that are integrated from the top in gammaness and from zero in off-angle, so that
+    the expected signal and background for any cut on the grid is a single look-up
+
+    the sensitivity is expressed as the fraction of the reference (Crab) flux that
+    gives an excess of `n_sigma` (Li & Ma) with the background of the off regions
+    (`1 / alpha` times larger, like in `cut_and_sensitivity`); the excess has to be at
+    least `max_background_ratio` of the background and there have to be at least
+    `min_n` gamma events left, otherwise the sensitivity is infinite
+
+    Parameters
+    ----------
+    events : dictionary of pandas DataFrames
+        the events of every channel ('g', 'p', 'e')
+    energy_bin_edges : astropy.Quantity
+        the edges of the energy bins
+    ga_edges, xi_edges : 1D arrays
+        the grid of gammaness and off-angle (in degrees) cut values
+    alpha : float
+        ratio of the sizes of the on and off regions
+    """
 
-    cut_events = {}
-    cut_energies, ga_cuts, xi_cuts = [], [], []
-    for elow, ehigh, emid in zip(optimise_bin_edges[:-1],
-                                 optimise_bin_edges[1:],
-                                 np.sqrt(optimise_bin_edges[:-1] *
-                                         optimise_bin_edges[1:])):
+    def __init__(self, events, energy_bin_edges, ga_edges, xi_edges, alpha,
+                 min_n=10, max_background_ratio=.05, n_sigma=5):
+        self.energy_bin_edges = energy_bin_edges
+        self.ga_edges = np.asarray(ga_edges)
+        self.xi_edges = np.asarray(xi_edges)
+        self.alpha = alpha
+        self.min_n = min_n
+        self.max_background_ratio = max_background_ratio
+        self.n_sigma = n_sigma
+
+        event_weights = make_sensitivity_calculator(events).event_weights
+
+        # (gamma weights, gamma counts, background weights) per energy bin and cut
+        self.signal = 0
+        self.n_signal = 0
+        self.background = 0
+        for key in events:
+            energies = events[key]["MC_Energy"].values
+            gammaness = events[key]["gammaness"].values
+            off_angle = np.asarray(events[key]["off_angle"].values, dtype=float)
+            if key != 'g':
+                # the background regions are larger to gather more statistics
+                off_angle = off_angle * alpha
+            weights = np.asarray(event_weights[key], dtype=float)
+
+            cumulative = self.fill_cumulative(energies, gammaness, off_angle, weights)
+            if key == 'g':
+                self.signal = cumulative
+                self.n_signal = self.fill_cumulative(energies, gammaness, off_angle,
+                                                     np.ones_like(weights))
+            else:
+                self.background = self.background + cumulative
+
+    def fill_cumulative(self, energies, gammaness, off_angle, weights):
+        """returns the sum of `weights` of the events with gammaness > `ga_edges[i]`
+        and off-angle < `xi_edges[j]` in energy bin `e` as entry `[e, i, j]`"""
+        e_bins = np.digitize(energies, self.energy_bin_edges.to(energy_unit).value) - 1
+        # an event passes the cut `gammaness > ga_edges[i]` for all i <= ga_bin and
+        # the cut `off_angle < xi_edges[j]` for all j > xi_bin
+        ga_bins = np.searchsorted(self.ga_edges, gammaness, side="left") - 1
+        xi_bins = np.searchsorted(self.xi_edges, off_angle, side="right")
+
+        n_e = len(self.energy_bin_edges) - 1
+        shape = (n_e, len(self.ga_edges) + 1, len(self.xi_edges) + 1)
+        in_range = (e_bins >= 0) & (e_bins < n_e) & (ga_bins >= 0)
+        histogram = np.bincount(
+            np.ravel_multi_index((e_bins[in_range], ga_bins[in_range],
+                                  xi_bins[in_range]), shape),
+            weights=weights[in_range], minlength=np.prod(shape)).reshape(shape)
+
+        # integrate gammaness from the top and off-angle from zero
+        histogram = np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1]
+        histogram = np.cumsum(histogram, axis=2)
+        return histogram[:, :-1, :-1]
+
+    def flux_scale(self, signal, n_signal, background, n_iter=60):
+        """fraction of the reference flux needed for an `n_sigma` detection; solved by
+        bisection in log-space for whole arrays at once
+
+        infinite where even 1e4 times the reference flux is not significant"""
+        low = np.full(np.shape(signal), -8.)
+        high = np.full(np.shape(signal), 4.)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # the upper end of the bracket has to be significant already
+            reachable = li_ma_significance(10**high * signal + self.alpha * background,
+                                           background, self.alpha) >= self.n_sigma
+            for i in range(n_iter):
+                mid = (low + high) / 2
+                n_on = 10**mid * signal + self.alpha * background
+                significant = li_ma_significance(n_on, background, self.alpha) \
+                    >= self.n_sigma
+                high = np.where(significant, mid, high)
+                low = np.where(significant, low, mid)
+
+            scale = 10**high
+            # the excess also has to stand out of the systematics of the background
+            scale = np.maximum(scale, self.max_background_ratio * self.alpha *
+                               background / signal)
+        scale[(n_signal < self.min_n) | (signal <= 0) | ~reachable] = np.inf
+        return scale
+
+    def sensitivity(self, ga_cut, xi_cut):
+        """sensitivity in every energy bin for the cut pair on the grid closest to
+        `(ga_cut, xi_cut)`"""
+        i = np.argmin(np.abs(self.ga_edges - ga_cut))
+        j = np.argmin(np.abs(self.xi_edges - xi_cut))
+        return self.flux_scale(self.signal[:, i, j], self.n_signal[:, i, j],
+                               self.background[:, i, j])
+
+    def scan(self):
+        """returns the sensitivity for all energy bins and all cut pairs on the grid"""
+        return self.flux_scale(self.signal, self.n_signal, self.background)
+
+    def optimal_cuts(self):
+        """returns the gammaness and off-angle cut with the best sensitivity for every
+        energy bin, and whether a finite sensitivity was found there"""
+        scan = self.scan().reshape(len(self.signal), -1)
+        best = np.argmin(scan, axis=1)
+        i, j = np.unravel_index(best, self.signal.shape[1:])
+        return self.ga_edges[i], self.xi_edges[j], np.isfinite(scan.min(axis=1))
+
+
+def get_optimal_splines_grid(events, optimise_bin_edges, k=1,
+                             ga_edges=np.linspace(.5, 1, 101),
+                             xi_edges=np.linspace(0, .5, 101)):
+    """same as `get_optimal_splines` but scans a grid of cut values with
+    `CumulativeSensitivity` instead of running a stochastic optimiser per bin"""
+    evaluator = CumulativeSensitivity(events, optimise_bin_edges,
+                                      ga_edges, xi_edges, alpha)
+    ga_cuts, xi_cuts, found = evaluator.optimal_cuts()
+
+    cut_energies = np.sqrt(optimise_bin_edges[:-1] * optimise_bin_edges[1:])
+    cut_energies = cut_energies[found].to(energy_unit).value
+    ga_cuts, xi_cuts = ga_cuts[found], xi_cuts[found]
+
+    spline_ga = interpolate.splrep(cut_energies, ga_cuts, k=k)
+    spline_xi = interpolate.splrep(cut_energies, xi_cuts, k=k)
+
+    return (spline_ga, list(ga_cuts)), (spline_xi, list(xi_cuts))
+
+
+def optimise_cuts_in_bin(task):
+    """runs the differential evolution for a single energy bin
+
+    Parameters
+    ----------
+    task : tuple
+        `(cut_events, bin_edges, seed, workers)` -- the events within the energy bin,
+        the edges of the bin, the seed for the optimiser and the number of processes
+        it may use to evaluate its population
+
+    Returns
+    -------
+    res : `scipy.optimize.OptimizeResult`
+    """
+    cut_events, bin_edges, seed, workers = task
+
+    # only ask for parallel population evaluation if requested, so that scipy
+    # versions without the `workers` argument keep working
+    parallel_kwargs = {"workers": workers, "updating": "deferred"} \
+        if workers != 1 else {}
+
+    return optimize.differential_evolution(
+        cut_and_sensitivity,
+        bounds=[(.5, 1), (0, 0.5)],
+        maxiter=1000, popsize=10,
+        seed=seed,
+        args=(cut_events, bin_edges, alpha),
+        **parallel_kwargs
+    )
+
+
+def get_optimal_splines(events, optimise_bin_edges, k=1, n_jobs=1, workers=1,
+                        seed=None):
+    """optimises the gammaness and off-angle cuts in every energy bin and fits splines
+    through the optimal values
+
+    Parameters
+    ----------
+    events : dictionary of pandas DataFrames
+        the events of every channel
+    optimise_bin_edges : astropy.Quantity
+        the edges of the energy bins to optimise the cuts in
+    k : integer (default: 1)
+        degree of the splines
+    n_jobs : integer (default: 1)
+        number of processes optimising the bins concurrently
+    workers : integer (default: 1)
+        number of processes every differential evolution uses to evaluate its
+        population; only sensible with `n_jobs = 1` since the processes of a pool
+        cannot start processes of their own
+    seed : integer, optional (default: None)
+        the optimisation in bin `i` is seeded with `seed + i`, so the results do not
+        depend on `n_jobs`
+
+    Returns
+    -------
+    (spline_ga, ga_cuts), (spline_xi, xi_cuts)
+    """
 
+    tasks, bin_centres = [], []
+    for i, (elow, ehigh, emid) in enumerate(zip(optimise_bin_edges[:-1],
+                                                optimise_bin_edges[1:],
+                                                np.sqrt(optimise_bin_edges[:-1] *
+                                                        optimise_bin_edges[1:]))):
+        cut_events = {}
         for key in events:
             cut_events[key] = events[key][
                 (events[key]["MC_Energy"] > elow) &
                 (events[key]["MC_Energy"] < ehigh)]
 
-        res = optimize.differential_evolution(
-            cut_and_sensitivity,
-            bounds=[(.5, 1), (0, 0.5)],
-            maxiter=1000, popsize=10,
-            args=(cut_events,
-                  np.array([elow / energy_unit,
-                            ehigh / energy_unit]) * energy_unit,
-                  alpha)
-        )
+        bin_edges = np.array([elow / energy_unit, ehigh / energy_unit]) * energy_unit
+        tasks.append((cut_events, bin_edges,
+                      None if seed is None else seed + i, workers))
+        bin_centres.append(emid)
 
+    if n_jobs > 1:
+        # the bins are independent; forking gives the workers the meta data as well
+        with multiprocessing.get_context("fork").Pool(n_jobs) as pool:
+            results = pool.map(optimise_cuts_in_bin, tasks, chunksize=1)
+    else:
+        results = [optimise_cuts_in_bin(task) for task in tasks]
+
+    cut_energies, ga_cuts, xi_cuts = [], [], []
+    for emid, res in zip(bin_centres, results):
         if res.success:
             cut_energies.append(emid.value)
             ga_cuts.append(res.x[0])
@@ -988,9 +1215,20 @@ if __name__ == "__main__":
     np.random.seed(19)
 
     parser = make_argparser()
+    parser.add_argument('-j', '--n_jobs', type=int, default=1,
+                        help="number of processes optimising the cuts of the energy "
+                        "bins")
     parser.add_argument('--infile', type=str, default="classified_events")
     parser.add_argument('--load', action="store_true", default=False,
                         help="load splines instead of fitting and writing")
+    parser.add_argument('--seed', type=int, default=19,
+                        help="seed of the cut optimisation")
+    parser.add_argument('--grid_scan', action="store_true", default=False,
+                        help="find the cuts with a grid scan over cumulative "
+                        "histograms instead of differential evolution")
+    parser.add_argument('--de_workers', type=int, default=1,
+                        help="number of processes each differential evolution uses to "
+                        "evaluate its population (use instead of --n_jobs)")
 
     args = parser.parse_args()
 
@@ -1060,11 +1298,17 @@ if __name__ == "__main__":
         print("making splines")
         cut_energies = sensitivity_energy_bin_edges[::]
         cut_energies_mid = np.sqrt(cut_energies[:-1] * cut_energies[1:])
-        (spline_w_ga, ga_cuts_w), (spline_w_th, th_cuts_w) = \
-            get_optimal_splines(events_w["reco"], cut_energies, k=1)
+        if args.grid_scan:
+            (spline_w_ga, ga_cuts_w), (spline_w_th, th_cuts_w) = \
+                get_optimal_splines_grid(events_w["reco"], cut_energies, k=1)
+        else:
+            (spline_w_ga, ga_cuts_w), (spline_w_th, th_cuts_w) = \
+                get_optimal_splines(events_w["reco"], cut_energies, k=1,
+                                    n_jobs=args.n_jobs, workers=args.de_workers,
+                                    seed=args.seed)
         print("... wavelets done")
         (spline_t_ga, ga_cuts_t), (spline_t_th, th_cuts_t) = \
-            (spline_w_ga, ga_cuts_w), (spline_w_th, xi_cuts_w)
+            (spline_w_ga, ga_cuts_w), (spline_w_th, th_cuts_w)
         # get_optimal_splines(events_t["reco"], cut_energies, k=1)
         print("... tailcuts done")
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+compares a scikit-learn random forest with its `CompactForest` version -- checks that
+both give the same predictions and times the loading and the predictions for large
+and small batches
+"""
+
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from tino_cta.compact_forest import CompactForest
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--n_images', type=int, default=50000)
+parser.add_argument('--n_estimators', type=int, default=40)
+args = parser.parse_args()
+
+# 14 features like the `ClassifierFeatures`, one of them integer-valued
+X = np.random.uniform(size=(2 * args.n_images, 14)).astype(np.float32)
+X[:, 4] = np.round(X[:, 4] * 20)
+y = np.where(X[:, 0] + X[:, 4] / 20 + np.random.normal(0, .3, len(X)) > 1, "g", "p")
+X_train, X_test = X[:args.n_images], X[args.n_images:]
+
+forest = RandomForestClassifier(args.n_estimators, random_state=0).fit(
+    X_train, y[:args.n_images])
+compact = CompactForest.from_sklearn(forest)
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    pickle_path = os.path.join(tmp_dir, "forest.pkl")
+    compact_path = os.path.join(tmp_dir, "forest.npz")
+    with open(pickle_path, "wb") as outfile:
+        pickle.dump(forest, outfile)
+    compact.save(compact_path)
+
+    start = time.time()
+    with open(pickle_path, "rb") as infile:
+        pickle.load(infile)
+    time_unpickle = time.time() - start
+
+    start = time.time()
+    compact = CompactForest.load(compact_path)
+    time_load = time.time() - start
+
+    print("file size -- pickle: {:.1f} MB, compact: {:.1f} MB".format(
+        os.path.getsize(pickle_path) / 2**20, os.path.getsize(compact_path) / 2**20))
+print("loading -- pickle: {:.3f} s, compact: {:.3f} s".format(time_unpickle, time_load))
+
+# compile the tree walking before timing it
+compact.predict_proba(X_test[:1])
+
+print("same predictions:", np.array_equal(forest.predict_proba(X_test),
+                                          compact.predict_proba(X_test)))
+for batch_size in [1, 10, 100, len(X_test)]:
+    n_repeat = max(1, 1000 // batch_size)
+    batch = X_test[:batch_size]
+
+    start = time.time()
+    for _ in range(n_repeat):
+        forest.predict_proba(batch)
+    time_sklearn = (time.time() - start) / n_repeat
+
+    start = time.time()
+    for _ in range(n_repeat):
+        compact.predict_proba(batch)
+    time_compact = (time.time() - start) / n_repeat
+
+    print("{:>6} images -- sklearn: {:.5f} s, compact: {:.5f} s, speed-up: {:.1f}".format(
+        batch_size, time_sklearn, time_compact, time_sklearn / time_compact))
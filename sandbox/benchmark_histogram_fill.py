@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+"""
+compares `nDHistogram.fill_many` with filling the same entries one by one through
+`nDHistogram.fill` -- checks that both give the same histogram and times them
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from tino_cta.Histogram import nDHistogram
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--n_entries', type=int, default=100000)
+args = parser.parse_args()
+
+bin_edges = [np.arange(6), np.linspace(-.1, .1, 42)]
+coordinates = [np.random.uniform(-1, 7, args.n_entries),
+               np.random.normal(0, .05, args.n_entries)]
+weights = np.random.exponential(10, args.n_entries)
+
+histo_loop = nDHistogram(bin_edges)
+start = time.time()
+for x, y, w in zip(*coordinates, weights):
+    histo_loop.fill([x, y], w)
+time_loop = time.time() - start
+
+histo_bulk = nDHistogram(bin_edges)
+start = time.time()
+histo_bulk.fill_many(coordinates, weights)
+time_bulk = time.time() - start
+
+print("same content:", np.allclose(histo_loop.data, histo_bulk.data)
+      and np.array_equal(histo_loop.norm, histo_bulk.norm))
+print("{} entries -- fill: {:.3f} s, fill_many: {:.4f} s, speed-up: {:.0f}".format(
+    args.n_entries, time_loop, time_bulk, time_loop / time_bulk))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+compares the experimental in-memory starlet filter (`wavelet_backend="numpy"`) with
+`mr_filter` on camera images of a simtel file -- how similar are the cleaned images and
+how many images per second does either backend clean for every camera type
+"""
+
+from os.path import expandvars
+from glob import glob
+import argparse
+import time
+
+import numpy as np
+
+from ctapipe.io.hessio import hessio_event_source
+from ctapipe.calib import CameraCalibrator
+
+from tino_cta.ImageCleaning import ImageCleaner
+from tino_cta.prepare_event import EventPreparer
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-i', '--infile', type=str, default=None,
+                    help="simtel file to take the images from; "
+                    "default: first gamma file in $CTA_DATA/Prod3b/Paranal/gamma/")
+parser.add_argument('-m', '--max_events', type=int, default=20)
+parser.add_argument('--max_images', type=int, default=200,
+                    help="maximum number of images per camera type")
+parser.add_argument('--wave_temp_dir', type=str, default='/dev/shm/')
+args = parser.parse_args()
+
+infile = args.infile or \
+    sorted(glob(expandvars("$CTA_DATA/Prod3b/Paranal/gamma/*simtel.gz")))[0]
+
+
+cleaners = {backend: ImageCleaner(mode="wave", wavelet_backend=backend,
+                                  island_cleaning=False, skip_edge_events=False,
+                                  tmp_files_directory=args.wave_temp_dir)
+            for backend in ["mrfilter", "numpy"]}
+cleaner = cleaners["mrfilter"]
+
+# collect the rectangular images of all camera types first
+calib = CameraCalibrator(None, None)
+images = {}
+for event in hessio_event_source(infile, max_events=args.max_events):
+    calib.calibrate(event)
+    for tel_id in event.dl0.tels_with_data:
+        camera = event.inst.subarray.tel[tel_id].camera
+        cam_id = camera.cam_id
+        if cam_id not in cleaner.wavelet_options:
+            continue
+        if len(images.setdefault(cam_id, [])) >= args.max_images:
+            continue
+
+        img = EventPreparer.pick_gain_channel(event.dl1.tel[tel_id].image, cam_id)
+        if camera.pix_type.startswith("hex"):
+            img = cleaner.geom_1d_to_2d["hex"](camera, img, cam_id)[1]
+        else:
+            img = cleaner.geom_1d_to_2d[cam_id](img)
+
+        # fill the fake pixels here so that both backends see the same noise
+        nan_mask = np.isnan(img)
+        img[nan_mask] = cleaner.noise_model[cam_id].rvs(size=np.count_nonzero(nan_mask))
+        images[cam_id].append((img, nan_mask))
+
+
+print("{:>10} {:>7} {:>12} {:>12} {:>12} {:>12}".format(
+    "cam_id", "images", "mrfilter/s", "numpy/s", "same pixels", "rel. diff"))
+for cam_id, imgs in sorted(images.items()):
+    cleaned = {}
+    rate = {}
+    for backend, clnr in cleaners.items():
+        start = time.time()
+        cleaned[backend] = [
+            clnr.wavelet_cleaning(img, raw_option_string=clnr.wavelet_options[cam_id])
+            for img, _ in imgs]
+        rate[backend] = len(imgs) / (time.time() - start)
+
+    # parity: fraction of camera pixels where both agree on being signal or not and the
+    # relative difference of the total signal in the images
+    same_pixels, rel_diff = [], []
+    for (_, nan_mask), mr_img, np_img in zip(imgs, cleaned["mrfilter"],
+                                             cleaned["numpy"]):
+        mr_img, np_img = mr_img[~nan_mask], np_img[~nan_mask]
+        same_pixels.append(np.mean((mr_img > 0) == (np_img > 0)))
+        if np.sum(mr_img) > 0:
+            rel_diff.append(abs(np.sum(np_img) - np.sum(mr_img)) / np.sum(mr_img))
+
+    print("{:>10} {:>7} {:>12.1f} {:>12.1f} {:>12.3f} {:>12.3f}".format(
+        cam_id, len(imgs), rate["mrfilter"], rate["numpy"],
+        np.mean(same_pixels), np.mean(rel_diff) if rel_diff else np.nan))
@@ -26,6 +26,10 @@ from ctapipe.reco.HillasReconstructor import \
 from helper_functions import *
 from tino_cta.ImageCleaning import ImageCleaner, EdgeEvent
 from tino_cta.prepare_event import EventPreparer
+from tino_cta.table_writer import create_table, ChunkedTableWriter, \
+    sigint_deferred
+from tino_cta.batch_prediction import predict_proba_batch, predict_energy_batch
+from tino_cta.compact_forest import CompactModel
 
 from ctapipe.reco.event_classifier import *
 from ctapipe.reco.energy_regressor import *
@@ -46,6 +50,8 @@ def main():
     min_tel = 3
 
     parser = make_argparser()
+    add_parallel_arguments(parser)
+    add_table_writer_arguments(parser)
     parser.add_argument('--classifier', type=str,
                         default='data/classifier_pickle/classifier'
                                 '_{mode}_{cam_id}_{classifier}.pkl')
@@ -54,6 +60,11 @@ def main():
                                 '_{mode}_{cam_id}_{regressor}.pkl')
     parser.add_argument('-o', '--outfile', type=str, default="",
                         help="location to write the classified events to.")
+    parser.add_argument('--checkpoint', type=int, default=1000,
+                        help="write the buffered events to disk every that many events")
+    parser.add_argument('--predict_batch', type=int, default=1000,
+                        help="number of events to collect before classifying them and "
+                        "estimating their energy in one go")
     parser.add_argument('--wave_dir', type=str, default=None,
                         help="directory where to find mr_filter. "
                              "if not set look in $PATH")
@@ -103,25 +114,38 @@ def main():
                 event_cutflow=Eventcutflow, image_cutflow=Imagecutflow,
                 # event/image cuts:
                 allowed_cam_ids=[],
-                min_ntel=2, min_charge=args.min_charge, min_pixel=3)
+                min_ntel=2, min_charge=args.min_charge, min_pixel=3,
+                # parallel processing:
+                n_jobs=args.n_jobs, ordered=args.ordered)
 
     # wrapper for the scikit-learn classifier
-    classifier = EventClassifier.load(
-                    args.classifier.format(**{
+    # (or its compact version if given the `.npz` files of `export_compact_models.py`)
+    classifier_path = args.classifier.format(**{
                             "mode": args.mode,
                             "wave_args": "mixed",
                             "classifier": 'RandomForestClassifier',
-                            "cam_id": "{cam_id}"}),
-                    cam_id_list=args.cam_ids)
+                            "cam_id": "{cam_id}"})
+    if classifier_path.endswith(".npz"):
+        classifier = CompactModel.load(classifier_path, cam_id_list=args.cam_ids)
+    else:
+        classifier = EventClassifier.load(classifier_path, cam_id_list=args.cam_ids)
 
     # wrapper for the scikit-learn regressor
-    regressor = EnergyRegressor.load(
-                    args.regressor.format(**{
+    regressor_path = args.regressor.format(**{
                             "mode": args.mode,
                             "wave_args": "mixed",
                             "regressor": "RandomForestRegressor",
-                            "cam_id": "{cam_id}"}),
-                    cam_id_list=args.cam_ids)
+                            "cam_id": "{cam_id}"})
+    if regressor_path.endswith(".npz"):
+        # the energy unit the regressor was trained with is stored in its files
+        regressor = CompactModel.load(regressor_path, cam_id_list=args.cam_ids)
+        if regressor.energy_unit is None:
+            # files exported before the unit was stored with them
+            print("no energy unit in {}; assuming {}".format(regressor_path,
+                                                            energy_unit))
+            regressor.energy_unit = energy_unit
+    else:
+        regressor = EnergyRegressor.load(regressor_path, cam_id_list=args.cam_ids)
 
     ClassifierFeatures = namedtuple(
         "ClassifierFeatures", (
@@ -190,8 +214,42 @@ def main():
                {"filename": "no_outfile.h5",
                 "driver": "H5FD_CORE", "driver_core_backing_store": False}))
 
-    reco_table = reco_outfile.create_table("/", "reco_events", RecoEvent)
-    reco_event = reco_table.row
+    reco_table = create_table(reco_outfile, "/", "reco_events", RecoEvent,
+                              complib=args.complib, complevel=args.complevel,
+                              chunkshape=args.chunkshape)
+    reco_writer = ChunkedTableWriter(reco_table, chunk_size=args.chunk_size)
+
+    # the reconstructed events waiting for their gammaness and energy estimate
+    # together with their classifier and regressor features
+    reco_queue = []
+
+    def predict_queued_events():
+        """runs the classifier and regressor on all queued events at once and passes
+        the completed events on to the writer; Ctrl+C is deferred until all of them
+        are in there, so that the exit hook can't write them a second time"""
+        with sigint_deferred():
+            # take the events out of the queue before writing any of them
+            queued, reco_queue[:] = list(reco_queue), []
+            if not queued:
+                return
+            reco_events, cls_features, reg_features = zip(*queued)
+            gammaness = predict_proba_batch(classifier, cls_features)[:, 0]
+            predict_energ = predict_energy_batch(regressor, reg_features)
+            for reco_event, gamma, energy in zip(reco_events, gammaness,
+                                                 predict_energ):
+                reco_event["reco_Energy"] = energy.to(energy_unit).value
+                reco_event["gammaness"] = gamma
+                reco_writer.append(reco_event)
+
+    def checkpoint():
+        with sigint_deferred():
+            predict_queued_events()
+            reco_writer.checkpoint()
+
+    # make sure the buffered events end up on disk even if the run gets killed by a
+    # second Ctrl+C
+    signal_handler.add_exit_hook(checkpoint)
+    n_events = 0
 
     allowed_tels = None  # all telescopes
     allowed_tels = prod3b_tel_ids("L+N+D")
@@ -268,16 +326,12 @@ def main():
                     cls_features_evt[cam_id] = [cls_features_tel]
 
             # save basic event infos
-            reco_event["MC_Energy"] = event.mc.energy.to(energy_unit).value
-            reco_event["Event_ID"] = event.r1.event_id
-            reco_event["Run_ID"] = event.r1.run_id
+            reco_event = {"MC_Energy": event.mc.energy.to(energy_unit).value,
+                          "Event_ID": event.r1.event_id,
+                          "Run_ID": event.r1.run_id}
 
             if cls_features_evt and reg_features_evt:
 
-                predict_energ = regressor.predict_by_event([reg_features_evt])["mean"][0]
-                predict_proba = classifier.predict_proba_by_event([cls_features_evt])
-                gammaness = predict_proba[0, 0]
-
                 # the MC direction of origin of the simulated particle
                 shower = event.mc
                 shower_core = np.array([shower.core_x / u.m, shower.core_y / u.m]) * u.m
@@ -302,7 +356,6 @@ def main():
                 reco_event["NTels_reco_lst"] = n_tels["LST"]
                 reco_event["NTels_reco_mst"] = n_tels["MST"]
                 reco_event["NTels_reco_sst"] = n_tels["SST"]
-                reco_event["reco_Energy"] = predict_energ.to(energy_unit).value
                 reco_event["reco_phi"] = phi / angle_unit
                 reco_event["reco_theta"] = theta / angle_unit
                 reco_event["off_angle"] = off_angle / angle_unit
@@ -310,15 +363,24 @@ def main():
                 reco_event["DeltaR"] = DeltaR / dist_unit
                 reco_event["ErrEstPos"] = err_est_pos / dist_unit
                 reco_event["ErrEstDir"] = err_est_dir / angle_unit
-                reco_event["gammaness"] = gammaness
-                reco_event.append()
-                reco_table.flush()
+
+                # gammaness and energy get estimated for many events at once
+                reco_queue.append((reco_event, cls_features_evt, reg_features_evt))
+                if len(reco_queue) >= args.predict_batch:
+                    predict_queued_events()
+
+            n_events += 1
+            if n_events % args.checkpoint == 0:
+                checkpoint()
 
             if signal_handler.stop:
                 break
         if signal_handler.stop:
             break
 
+    # process and write out whatever is still in the buffers
+    checkpoint()
+
     try:
         print()
         Eventcutflow()
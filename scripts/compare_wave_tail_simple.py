@@ -6,7 +6,7 @@ import argparse
 
 import numpy as np
 
-from scipy import optimize, interpolate
+from scipy import interpolate
 
 from astropy import units as u
 from astropy.table import Table
@@ -44,32 +44,69 @@ def diff_to_X_purity(gammaness, events, target, signal=None):
         return ((n_sig / (n_sig + n_bck)) - target)**2
 
 
-def get_gammaness_for_target_purity(events, target):
-
-    gammaness = []
+def get_gammaness_for_target_purities(events, targets, signal=None):
+    """finds the gammaness cut for every energy bin and every purity in `targets`
+
+    instead of minimising `diff_to_X_purity`, the events of an energy bin are sorted by
+    gammaness once; the purity of every possible cut then follows from the cumulative
+    number of signal events, and for every target the cut with the closest purity is
+    picked -- exactly, and for all targets at once
+
+    Parameters
+    ----------
+    events : dictionary of pandas DataFrames
+        the events of every channel
+    targets : list or array of floats
+        the purities to find the cuts for
+    signal : list of strings, optional (default: ['g'])
+        the channels that count as signal
+
+    Returns
+    -------
+    gammaness : 2D array
+        the cut values with shape `(len(targets), n_energy_bins)`; only events with a
+        gammaness strictly above the cut pass
+    """
+    signal = signal or ['g']
+    targets = np.array(targets, ndmin=1)
 
-    print("doing optimisation now")
-    for e_low, e_high, e_mid in zip(irf.e_bin_edges[:-1],
-                                    irf.e_bin_edges[1:],
-                                    irf.e_bin_centres):
-        # print(f"e_low = {e_low}")
-        cut_events = {}
+    gammaness = np.zeros((len(targets), len(irf.e_bin_centres)))
+    for i, (e_low, e_high) in enumerate(zip(irf.e_bin_edges[:-1],
+                                            irf.e_bin_edges[1:])):
+        bin_gammaness, bin_is_signal = [], []
         for ch, ev in events.items():
-            cut_events[ch] = ev[(ev[irf.mc_energy_name] > e_low) &
-                                (ev[irf.mc_energy_name] < e_high)]
-        res = optimize.differential_evolution(
-            diff_to_X_purity,
-            maxiter=1000, popsize=10,
-            args=(cut_events, target),
-            bounds=[(0, 1)],
-        )
-        if res.success:
-            gammaness.append(res.x[0])
-        else:
-            gammaness.append(0)
+            ev_gammaness = ev["gammaness"][(ev[irf.mc_energy_name] > e_low) &
+                                           (ev[irf.mc_energy_name] < e_high)].values
+            bin_gammaness.append(ev_gammaness)
+            bin_is_signal.append(np.full(len(ev_gammaness), ch in signal))
+        bin_gammaness = np.concatenate(bin_gammaness)
+        bin_is_signal = np.concatenate(bin_is_signal)
+
+        if len(bin_gammaness) == 0:
+            continue
+
+        # sort the events from high to low gammaness; a cut just below the n-th
+        # event keeps the first n of them
+        order = np.argsort(-bin_gammaness, kind="stable")
+        sorted_gammaness = bin_gammaness[order]
+        purity = np.cumsum(bin_is_signal[order]) / np.arange(1, len(order) + 1)
+
+        # the cut value is the gammaness of the first rejected event (0 if all pass);
+        # among events of equal gammaness, only the last one marks a possible cut
+        cut_values = np.append(sorted_gammaness[1:], 0)
+        possible = np.append(sorted_gammaness[1:] < sorted_gammaness[:-1], True)
+        purity, cut_values = purity[possible], cut_values[possible]
+
+        best = np.argmin(np.abs(purity[None, :] - targets[:, None]), axis=1)
+        gammaness[:, i] = cut_values[best]
+
     return gammaness
 
 
+def get_gammaness_for_target_purity(events, target):
+    return list(get_gammaness_for_target_purities(events, [target])[0])
+
+
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('--indir',
                     default=expandvars("$CTA_SOFT/tino_cta/data/prod3b/paranal_LND"))
@@ -101,35 +138,16 @@ for c in irf.plotting.channel_map:
 
 # # # # # #
 # determine optimal bin-by-bin cut values and fit splines to them
-def main(purity, all_events, args):
+def main(purity, all_events, args, ga_cuts=None):
     xi_cuts = {}
-    ga_cuts = {}
+    # the gammaness cuts can be given, e.g. when they were determined for the whole
+    # sweep over the purities at once
+    ga_cuts = dict(ga_cuts or {})
     # fig, axes = plt.subplots(1, 2, figsize=(10, 5))
     for mode in modes:
         xi_cuts[mode] = irf.irfs.get_angular_resolution(all_events[mode])
-        if True:
-            ga_cuts[mode] = get_gammaness_for_target_purity(all_events[mode], args.purity)
-        else:
-            ga_cuts["tail"] = [0.00010797506398901868, 0.1755767099797223,
-                               0.75512375889607319, 0.95315723793511065,
-                               0.9918075064217492, 0.9950950534358125,
-                               0.99035880010037181, 0.97337397150095684,
-                               0.95496618056823357, 0.95326166540164403,
-                               0.94959951856254943, 0.93741002949880992,
-                               0.92214253489467879, 0.90634486820581173,
-                               0.89279990617402805, 0.87853035376596433,
-                               0.87288220808693284, 0.878079494796003,
-                               0.8557482520923928]
-            ga_cuts["wave"] = [0.00032108517271961512, 0.058295752528910283,
-                               0.74258793260276645, 0.95654804819785022,
-                               0.98909886863845242, 0.99337538669131609,
-                               0.98612760716648884, 0.96106703954423656,
-                               0.9352384171690159, 0.94319842943480203,
-                               0.93910583837329253, 0.93673481528761127,
-                               0.91640867834111783, 0.90671758177465511,
-                               0.89253479608630659, 0.87534228528795499,
-                               0.86440677324889814, 0.87561903218727266,
-                               0.83751966865987681]
+        if mode not in ga_cuts:
+            ga_cuts[mode] = get_gammaness_for_target_purity(all_events[mode], purity)
 
     #     plt.sca(axes[0])
     #     plt.plot(irf.e_bin_centres, xi_cuts[mode]['g'], label=mode)
@@ -183,11 +201,17 @@ def main(purity, all_events, args):
 
 if __name__ == "__main__":
     purities = np.linspace(.9, .99, 20)
+
+    # the gammaness cuts for all purities in one go
+    ga_cuts_sweep = {mode: get_gammaness_for_target_purities(all_events[mode], purities)
+                     for mode in modes}
+
     sig_w = []
     sig_t = []
-    for pur in purities:
+    for i, pur in enumerate(purities):
         print(f"purity {pur}")
-        sig = main(all_events=all_events, purity=pur, args=args)
+        sig = main(all_events=all_events, purity=pur, args=args,
+                   ga_cuts={mode: ga_cuts_sweep[mode][i] for mode in modes})
         sig_w.append(sig["wave"])
         sig_t.append(sig["tail"])
         print()
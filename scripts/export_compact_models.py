@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+"""
+converts the pickled classifier and regressor of every camera type into the compact
+`.npz` files of `tino_cta.compact_forest`; the new files are put next to the pickles
+with the same name and `classify_and_reconstruct.py` reads them if it is given the
+`.npz` paths
+"""
+
+import os
+
+from ctapipe.reco.event_classifier import EventClassifier
+from ctapipe.reco.energy_regressor import EnergyRegressor
+
+from helper_functions import make_argparser
+from tino_cta.compact_forest import CompactModel
+
+
+parser = make_argparser()
+parser.add_argument('--classifier', type=str,
+                    default='data/classifier_pickle/classifier'
+                            '_{mode}_{cam_id}_{classifier}.pkl')
+parser.add_argument('--regressor', type=str,
+                    default='data/classifier_pickle/regressor'
+                            '_{mode}_{cam_id}_{regressor}.pkl')
+parser.add_argument('--no_compress', dest='compress', action='store_false',
+                    help="write the arrays uncompressed; bigger but faster to read")
+args = parser.parse_args()
+
+for wrapper, path in [
+        (EventClassifier, args.classifier.format(
+            mode=args.mode, classifier='RandomForestClassifier', cam_id="{cam_id}")),
+        (EnergyRegressor, args.regressor.format(
+            mode=args.mode, regressor='RandomForestRegressor', cam_id="{cam_id}"))]:
+
+    model = wrapper.load(path, cam_id_list=args.cam_ids)
+    compact_path = os.path.splitext(path)[0] + ".npz"
+    CompactModel.from_model(model).save(compact_path, compress=args.compress)
+
+    for cam_id in args.cam_ids:
+        print("{:>10}: {:.1f} MB -> {:.1f} MB ({})".format(
+            cam_id,
+            os.path.getsize(path.format(cam_id=cam_id)) / 2**20,
+            os.path.getsize(compact_path.format(cam_id=cam_id)) / 2**20,
+            compact_path.format(cam_id=cam_id)))
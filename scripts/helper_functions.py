@@ -13,23 +13,40 @@ class SignalHandler():
         `signal.signal(signal.SIGINT, signal_handler)`
         # or for two step interupt:
         `signal.signal(signal.SIGINT, signal_handler.stop_drawing)`
+        functions registered with `add_exit_hook` (e.g. flushing the output buffers)
+        are still called if the second Ctrl+C exits immediately; they run inside the
+        handler, so the writes they might interrupt have to defer SIGINT, cf.
+        `tino_cta.table_writer.sigint_deferred`
     '''
     def __init__(self):
         self.stop = False
         self.draw = True
+        self.exiting = False
+        self.exit_hooks = []
+
+    def add_exit_hook(self, hook):
+        self.exit_hooks.append(hook)
+
+    def exit_now(self):
+        # a further Ctrl+C must not run the hooks a second time
+        if self.exiting:
+            return
+        self.exiting = True
+        print('you pressed Ctrl+C again -- exiting NOW')
+        for hook in self.exit_hooks:
+            hook()
+        exit(-1)
 
     def __call__(self, signal, frame):
         if self.stop:
-            print('you pressed Ctrl+C again -- exiting NOW')
-            exit(-1)
+            self.exit_now()
         print('you pressed Ctrl+C!')
         print('exiting after current event')
         self.stop = True
 
     def stop_drawing(self, signal, frame):
         if self.stop:
-            print('you pressed Ctrl+C again -- exiting NOW')
-            exit(-1)
+            self.exit_now()
 
         if self.draw:
             print('you pressed Ctrl+C!')
@@ -93,6 +110,53 @@ def make_argparser():
     return parser
 
 
+def add_parallel_arguments(parser):
+    """options of the multi-process mode of `EventPreparer` for the scripts that
+    prepare the events with it"""
+    parser.add_argument('-j', '--n_jobs', type=int, default=1,
+                        help="number of processes to prepare the events with")
+    parser.add_argument('--unordered', dest='ordered', action='store_false',
+                        help="with n_jobs > 1, process the events as they come in "
+                        "instead of in the order they are read")
+    return parser
+
+
+def add_table_writer_arguments(parser):
+    """options of `tino_cta.table_writer` for the scripts that write event tables"""
+    parser.add_argument('--chunk_size', type=int, default=10000,
+                        help="number of rows collected before writing them to file")
+    parser.add_argument('--complib', type=str, default="blosc:zstd",
+                        help="compression library for the output tables")
+    parser.add_argument('--complevel', type=int, default=5,
+                        help="compression level for the output tables; 0 turns off "
+                        "the compression and with it --complib")
+    parser.add_argument('--chunkshape', type=int, default=None,
+                        help="number of rows per HDF5 chunk of the output tables")
+    return parser
+
+
+def add_training_set_arguments(parser):
+    """options of `tino_cta.training_set.load_training_set` and
+    `tino_cta.parallel_training.fit_per_camera` for the training scripts"""
+    parser.add_argument('--max_rows', type=int, default=None,
+                        help="train on at most this many images per camera type "
+                        "(and channel)")
+    parser.add_argument('--fraction', type=float, default=None,
+                        help="train on a random fraction of the images")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the random selection of the training images")
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="keep the training arrays as memory-mapped .npy files "
+                        "in this directory")
+    parser.add_argument('-j', '--n_jobs', type=int, default=1,
+                        help="number of camera types whose models are fitted at the "
+                        "same time")
+    parser.add_argument('--n_threads', type=int, default=None,
+                        help="number of threads per random forest; with -j, the "
+                        "models of that many camera types are fitted at once")
+    return parser
+
+
 try:
     from matplotlib2tikz import save as tikzsave
 
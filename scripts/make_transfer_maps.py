@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+pre-generates the transfer maps of the hex-to-rect conversion for all hexagonal cameras
+found in a simtel file (for Prod3b: LSTCam, NectarCam, FlashCam and DigiCam) and writes
+them into the on-disk cache of `tino_cta.geometry_converter` so that the analysis jobs
+only have to read them in
+"""
+
+from os.path import expandvars
+from glob import glob
+import argparse
+import time
+
+from ctapipe.io.hessio import hessio_event_source
+from ctapipe.coordinates.coordinate_transformations import transform_pixel_position
+
+from tino_cta import geometry_converter
+from tino_cta.geometry_converter import (get_geometry_hash, get_transfer_map_path,
+                                         make_transfer_maps, write_transfer_maps)
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-i', '--infile', type=str, default=None,
+                    help="simtel file to take the camera geometries from; "
+                    "default: first gamma file in $CTA_DATA/Prod3b/Paranal/gamma/")
+parser.add_argument('-o', '--outdir', type=str, default=None,
+                    help="directory to write the maps into; default: {}".format(
+                        geometry_converter.transfer_map_dir))
+parser.add_argument('--add_rot', type=int, default=0,
+                    help="additional rotation of the hex grid in units of 60°")
+parser.add_argument('-f', '--force', action='store_true',
+                    help="regenerate the maps even if they are already in the cache")
+args = parser.parse_args()
+
+infile = args.infile or \
+    sorted(glob(expandvars("$CTA_DATA/Prod3b/Paranal/gamma/*simtel.gz")))[0]
+if args.outdir:
+    geometry_converter.transfer_map_dir = args.outdir
+
+# the instrument description is complete with the first event already
+event = next(hessio_event_source(infile, max_events=1))
+
+done = set()
+for tel_id, tel in sorted(event.inst.subarray.tel.items()):
+    camera = tel.camera
+    if not camera.pix_type.startswith("hex") or camera.cam_id in done:
+        continue
+    done.add(camera.cam_id)
+
+    # bring the camera into the same orientation `EventPreparer` uses
+    camera.pix_x, camera.pix_y = transform_pixel_position(camera.pix_x, camera.pix_y)
+
+    path = get_transfer_map_path(get_geometry_hash(camera, args.add_rot),
+                                 camera.cam_id)
+    if args.force or not glob(path):
+        start = time.time()
+        transfer_maps = make_transfer_maps(camera, args.add_rot)
+        write_transfer_maps(path, transfer_maps)
+        print("{:>10}: wrote {} ({} × {} grid, {:.2f} s)".format(
+            camera.cam_id, path, *transfer_maps["hex_to_rect_map"].shape,
+            time.time() - start))
+    else:
+        print("{:>10}: {} already exists".format(camera.cam_id, path))
@@ -6,9 +6,6 @@ from os.path import expandvars
 from collections import namedtuple
 from glob import glob
 
-# PyTables
-import tables as tb
-
 from ctapipe.io.hessio import hessio_event_source
 
 from ctapipe.utils import linalg
@@ -19,8 +16,10 @@ from ctapipe.reco.event_classifier import EventClassifier
 from ctapipe.reco.HillasReconstructor import \
     HillasReconstructor, TooFewTelescopes
 
-from modules.prepare_event import EventPreparer
-from modules.ImageCleaning import ImageCleaner
+from tino_cta.prepare_event import EventPreparer
+from tino_cta.ImageCleaning import ImageCleaner
+from tino_cta.training_set import load_training_set
+from tino_cta.parallel_training import fit_per_camera, print_training_report
 
 from helper_functions import *
 
@@ -70,55 +69,28 @@ parser.add_argument('--check', action='store_true',
                     help="run a self check on the classification")
 parser.add_argument('--unify', action='store_true',
                     help="weight the images to 1 per (channel and camera)")
+add_training_set_arguments(parser)
 args = parser.parse_args()
 
 
-feature_file_gammas = tb.open_file(f"data/features_{args.mode}_gamma.h5", mode="r")
-feature_file_proton = tb.open_file(f"data/features_{args.mode}_proton.h5", mode="r")
-
-feature_file = feature_file_gammas
-features = {"LSTCam": [[row[name] for name in ClassifierFeatures._fields] for row in
-                       feature_file.root.feature_events_lst],
-            "DigiCam": [[row[name] for name in ClassifierFeatures._fields] for row in
-                        feature_file.root.feature_events_dig],
-            "NectarCam": [[row[name] for name in ClassifierFeatures._fields] for row in
-                          feature_file.root.feature_events_nec]}
-
-energies = {"LSTCam": [row["MC_Energy"] for row in
-                       feature_file.root.feature_events_lst],
-            "DigiCam": [row["MC_Energy"] for row in
-                        feature_file.root.feature_events_dig],
-            "NectarCam": [row["MC_Energy"] for row in
-                          feature_file.root.feature_events_nec]}
-
-classes = {}
-for cam_id, feats in features.items():
-    classes[cam_id] = ["g"] * len(feats)
-
-#
-# now protons
-feature_file = feature_file_proton
-features["LSTCam"] += [[row[name] for name in ClassifierFeatures._fields] for row in
-                       feature_file.root.feature_events_lst]
-features["DigiCam"] += [[row[name] for name in ClassifierFeatures._fields] for row in
-                        feature_file.root.feature_events_dig]
-features["NectarCam"] += [[row[name] for name in ClassifierFeatures._fields] for row in
-                          feature_file.root.feature_events_nec]
-energies["LSTCam"] += [row["MC_Energy"] for row in
-                       feature_file.root.feature_events_lst]
-energies["DigiCam"] += [row["MC_Energy"] for row in
-                        feature_file.root.feature_events_dig]
-energies["NectarCam"] += [row["MC_Energy"] for row in
-                          feature_file.root.feature_events_nec]
-for cam_id, feats in features.items():
-    classes[cam_id] += ["p"] * (len(feats) - len(classes[cam_id]))
-    energies[cam_id] = np.array(energies[cam_id]) * energy_unit
+# read the features of the gamma and the proton images into one array per camera type
+features, classes = {}, {}
+for channel in ["gamma", "proton"]:
+    channel_features = load_training_set(
+        f"data/features_{args.mode}_{channel}.h5", ClassifierFeatures._fields,
+        cam_ids=cam_id_list, max_rows=args.max_rows, fraction=args.fraction,
+        seed=args.seed, cache_dir=args.cache_dir)
+    for cam_id, feats in channel_features.items():
+        features.setdefault(cam_id, []).append(feats)
+        classes.setdefault(cam_id, []).append(np.full(len(feats), channel[0]))
+for cam_id in features:
+    features[cam_id] = np.concatenate(features[cam_id])
+    classes[cam_id] = np.concatenate(classes[cam_id])
 
 
 telescope_weights = {}
 for cam_id, cl in classes.items():
     print(cam_id)
-    cl = np.array(cl)
     telescope_weights[cam_id] = np.ones_like(cl, dtype=np.float)
     if args.unify:
         telescope_weights[cam_id][cl == 'g'] = \
@@ -134,7 +106,9 @@ for cam_id, cl in classes.items():
 clf_kwargs = {'n_estimators': 40, 'max_depth': None, 'min_samples_split': 2,
               'random_state': 0, 'cam_id_list': cam_id_list}
 classifier = EventClassifier(**clf_kwargs)
-classifier.fit(features, classes, telescope_weights)
+reports = fit_per_camera(classifier, features, classes, telescope_weights,
+                         n_jobs=args.n_jobs, n_threads=args.n_threads)
+print_training_report(reports)
 
 if args.store:
     classifier.save(args.outpath.format(mode=args.mode,
@@ -6,9 +6,6 @@ from os.path import expandvars
 from collections import namedtuple
 from glob import glob
 
-# PyTables
-import tables as tb
-
 from ctapipe.io.hessio import hessio_event_source
 
 from ctapipe.utils import linalg
@@ -19,8 +16,10 @@ from ctapipe.reco.energy_regressor import *
 from ctapipe.reco.HillasReconstructor import \
     HillasReconstructor, TooFewTelescopes
 
-from modules.prepare_event import EventPreparer
-from modules.ImageCleaning import ImageCleaner
+from tino_cta.prepare_event import EventPreparer
+from tino_cta.ImageCleaning import ImageCleaner
+from tino_cta.training_set import load_training_set
+from tino_cta.parallel_training import fit_per_camera, print_training_report
 
 from helper_functions import *
 
@@ -68,31 +67,23 @@ parser.add_argument('-o', '--outpath', type=str,
                             '_{mode}_{cam_id}_{regressor}.pkl')
 parser.add_argument('--check', action='store_true',
                     help="run a self check on the classification")
+add_training_set_arguments(parser)
 args = parser.parse_args()
 
 
-feature_file_gammas = tb.open_file(f"data/features_{args.mode}_gamma.h5", mode="r")
-
-feature_file = feature_file_gammas
-features = {"LSTCam": [[row[name] for name in EnergyFeatures._fields] for row in
-                       feature_file.root.feature_events_lst],
-            "DigiCam": [[row[name] for name in EnergyFeatures._fields] for row in
-                        feature_file.root.feature_events_dig],
-            "NectarCam": [[row[name] for name in EnergyFeatures._fields] for row in
-                          feature_file.root.feature_events_nec]}
-
-energies = {"LSTCam": np.array([row["MC_Energy"] for row in
-                                feature_file.root.feature_events_lst]) * energy_unit,
-            "DigiCam": np.array([row["MC_Energy"] for row in
-                                 feature_file.root.feature_events_dig]) * energy_unit,
-            "NectarCam": np.array([row["MC_Energy"] for row in
-                                   feature_file.root.feature_events_nec]) * energy_unit}
+features, energies = load_training_set(
+    f"data/features_{args.mode}_gamma.h5", EnergyFeatures._fields,
+    target_name="MC_Energy", cam_ids=cam_id_list, max_rows=args.max_rows,
+    fraction=args.fraction, seed=args.seed, cache_dir=args.cache_dir)
+energies = {cam_id: energy * energy_unit for cam_id, energy in energies.items()}
 
 # use default random forest regressor
 reg_kwargs = {'n_estimators': 40, 'max_depth': None, 'min_samples_split': 2,
               'random_state': 0, 'cam_id_list': cam_id_list}
 regressor = EnergyRegressor(**reg_kwargs)
-regressor.fit(features, energies)
+reports = fit_per_camera(regressor, features, energies,
+                         n_jobs=args.n_jobs, n_threads=args.n_threads)
+print_training_report(reports)
 
 if args.store:
     regressor.save(args.outpath.format(mode=args.mode,
@@ -24,8 +24,9 @@ from ctapipe.image.hillas import HillasParameterizationError, \
 from ctapipe.reco.HillasReconstructor import HillasReconstructor
 
 # tino_cta
-from modules.ImageCleaning import ImageCleaner
-from modules.prepare_event import EventPreparer
+from tino_cta.ImageCleaning import ImageCleaner
+from tino_cta.prepare_event import EventPreparer
+from tino_cta.table_writer import create_table, ChunkedTableWriter
 
 
 if __name__ == "__main__":
@@ -36,6 +37,8 @@ if __name__ == "__main__":
     dist_unit = u.m
 
     parser = make_argparser()
+    add_parallel_arguments(parser)
+    add_table_writer_arguments(parser)
     parser.add_argument('-o', '--outfile', type=str, required=True)
 
     group = parser.add_mutually_exclusive_group()
@@ -85,7 +88,9 @@ if __name__ == "__main__":
         # event/image cuts:
         allowed_cam_ids=[],
         min_ntel=2,
-        min_charge=args.min_charge, min_pixel=3)
+        min_charge=args.min_charge, min_pixel=3,
+        # parallel processing:
+        n_jobs=args.n_jobs, ordered=args.ordered)
 
     # catch ctr-c signal to exit current loop and still display results
     signal_handler = SignalHandler()
@@ -109,18 +114,18 @@ if __name__ == "__main__":
         MC_Energy = tb.FloatCol(dflt=1, pos=14)
 
     feature_outfile = tb.open_file(args.outfile, mode="w")
-    feature_table_lst = feature_outfile.create_table("/", "feature_events_lst",
-                                                     EventFeatures)
-    feature_table_nec = feature_outfile.create_table("/", "feature_events_nec",
-                                                     EventFeatures)
-    feature_table_dig = feature_outfile.create_table("/", "feature_events_dig",
-                                                     EventFeatures)
-    feature_table = {"LSTCam": feature_table_lst,
-                     "NectarCam": feature_table_nec,
-                     "DigiCam": feature_table_dig}
-    feature_events = {"LSTCam": feature_table_lst.row,
-                      "NectarCam": feature_table_nec.row,
-                      "DigiCam": feature_table_dig.row}
+    feature_table = {}
+    feature_events = {}
+    for cam_id, table_name in [("LSTCam", "feature_events_lst"),
+                               ("NectarCam", "feature_events_nec"),
+                               ("DigiCam", "feature_events_dig")]:
+        feature_table[cam_id] = create_table(
+            feature_outfile, "/", table_name, EventFeatures,
+            complib=args.complib, complevel=args.complevel,
+            chunkshape=args.chunkshape)
+        feature_events[cam_id] = ChunkedTableWriter(feature_table[cam_id],
+                                                    chunk_size=args.chunk_size)
+        signal_handler.add_exit_hook(feature_events[cam_id].checkpoint)
 
     pe_thersh = 100
     n_faint_img = []
@@ -150,22 +155,22 @@ if __name__ == "__main__":
                 if moments.size > pe_thersh:
                     n_faint += 1
 
-                feature_events[cam_id]["impact_dist"] = impact_dist / dist_unit
-                feature_events[cam_id]["sum_signal_evt"] = tot_signal
-                feature_events[cam_id]["max_signal_cam"] = max_signals[tel_id]
-                feature_events[cam_id]["sum_signal_cam"] = moments.size
-                feature_events[cam_id]["N_LST"] = n_tels["LST"]
-                feature_events[cam_id]["N_MST"] = n_tels["MST"]
-                feature_events[cam_id]["N_SST"] = n_tels["SST"]
-                feature_events[cam_id]["width"] = moments.width / dist_unit
-                feature_events[cam_id]["length"] = moments.length / dist_unit
-                feature_events[cam_id]["skewness"] = moments.skewness
-                feature_events[cam_id]["kurtosis"] = moments.kurtosis
-                feature_events[cam_id]["h_max"] = h_max / dist_unit
-                feature_events[cam_id]["err_est_pos"] = err_est_pos / dist_unit
-                feature_events[cam_id]["err_est_dir"] = err_est_dir / angle_unit
-                feature_events[cam_id]["MC_Energy"] = event.mc.energy / energy_unit
-                feature_events[cam_id].append()
+                feature_events[cam_id].append({
+                    "impact_dist": impact_dist / dist_unit,
+                    "sum_signal_evt": tot_signal,
+                    "max_signal_cam": max_signals[tel_id],
+                    "sum_signal_cam": moments.size,
+                    "N_LST": n_tels["LST"],
+                    "N_MST": n_tels["MST"],
+                    "N_SST": n_tels["SST"],
+                    "width": moments.width / dist_unit,
+                    "length": moments.length / dist_unit,
+                    "skewness": moments.skewness,
+                    "kurtosis": moments.kurtosis,
+                    "h_max": h_max / dist_unit,
+                    "err_est_pos": err_est_pos / dist_unit,
+                    "err_est_dir": err_est_dir / angle_unit,
+                    "MC_Energy": event.mc.energy / energy_unit})
 
             n_faint_img.append(n_faint)
             n_total_img.append(len(hillas_dict))
@@ -177,8 +182,8 @@ if __name__ == "__main__":
             break
 
     # make sure that all the events are properly stored
-    for table in feature_table.values():
-        table.flush()
+    for writer in feature_events.values():
+        writer.flush()
 
     def averages(values, bin_values, bin_edges):
         averages_binned = \
@@ -10,7 +10,9 @@ setup(
     scripts=[
         'scripts/classify_and_reconstruct.py',
         'scripts/compare_wave_tail_simple.py',
+        'scripts/export_compact_models.py',
         'scripts/fit_events_hillas.py',
+        'scripts/make_transfer_maps.py',
         'scripts/train_classifier.py',
         'scripts/train_energy_regressor.py',
         'scripts/write_feature_table.py'
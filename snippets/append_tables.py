@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 
-from os.path import expandvars
+import os
+from collections import deque
+import hashlib
+import multiprocessing
 import argparse
 
 import glob
 
+import numpy as np
+
 # PyTables
 try:
     import tables as tb
@@ -18,36 +23,249 @@ except ImportError:
     print("no pandas installed?")
 
 
-def merge_list_of_pytables(filename_list, destination):
-    pyt_table = None
-    outfile = tb.open_file(destination, mode="w")
-    for i, filename in enumerate(sorted(filename_list)):
-        print(filename)
+class MergeError(Exception):
+    pass
+
+
+# one row per merged input file in the `merged_files` table of the output
+merged_file_dtype = np.dtype([("filename", "S256"), ("n_rows", "i8"), ("size", "i8"),
+                              ("mtime", "f8"), ("md5", "S32")])
+
+
+def get_md5(filename, block_size=2**20):
+    md5 = hashlib.md5()
+    with open(filename, "rb") as infile:
+        for block in iter(lambda: infile.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def file_record(filename, n_rows, with_md5=False):
+    """the entry of `filename` in the `merged_files` table; the checksum is only
+    computed `with_md5`, since it means reading the whole file once more"""
+    stat = os.stat(filename)
+    return np.array((os.path.basename(filename), n_rows, stat.st_size, stat.st_mtime,
+                     get_md5(filename) if with_md5 else ""), dtype=merged_file_dtype)
+
+
+def read_table(filename, node="reco_events", with_md5=False):
+    """reads the table `node` of `filename` completely
+
+    Returns
+    -------
+    rows : numpy structured array or None
+        the content of the table; None if the file or the table could not be read
+    record : numpy structured array or None
+        the entry of the file in the `merged_files` table, cf. `file_record`
+    """
+    try:
+        with tb.open_file(filename, mode="r") as infile:
+            rows = infile.get_node("/", node).read()
+        return rows, file_record(filename, len(rows), with_md5)
+    except (IOError, OSError, tb.HDF5ExtError, tb.NoSuchNodeError) as e:
+        print("skipping {}: {}".format(filename, e))
+        return None, None
+
+
+def _read_table_task(task):
+    return read_table(*task)
+
+
+def iter_tables(filename_list, node="reco_events", n_jobs=1, with_md5=False):
+    """reads the table `node` of every file in `filename_list` and yields
+    `(rows, record)` in the order of `filename_list`; cf. `read_table`
+
+    with `n_jobs > 1`, the files are read in that many worker processes; never more
+    than `2 * n_jobs` files are read ahead of the consumer, so the memory stays
+    bounded however many files there are
+    """
+    tasks = ((filename, node, with_md5) for filename in filename_list)
+    if n_jobs <= 1:
+        yield from map(_read_table_task, tasks)
+        return
+
+    pool = multiprocessing.get_context("fork").Pool(n_jobs)
+    try:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_read_table_task, (task,)))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_chunks(filename_list, node="reco_events", n_jobs=1, chunk_size=100000,
+                with_md5=False):
+    """collects the rows of the tables of all files into chunks of at least
+    `chunk_size` rows (except for the last one)
+
+    Yields
+    ------
+    chunk : numpy structured array
+    records : numpy structured array
+        the `merged_files` entries of the files whose rows are in `chunk`
+    """
+    buffer, records, n_buffered = [], [], 0
+    for i, (rows, record) in enumerate(iter_tables(filename_list, node, n_jobs,
+                                                   with_md5)):
+        if (i + 1) % 100 == 0:
+            print("read {} of {} files".format(i + 1, len(filename_list)))
+        if rows is None:
+            continue
+        buffer.append(rows)
+        records.append(record)
+        n_buffered += len(rows)
+        if n_buffered >= chunk_size:
+            yield np.concatenate(buffer), np.array(records)
+            buffer, records, n_buffered = [], [], 0
+    if buffer:
+        yield np.concatenate(buffer), np.array(records)
+
 
-        pyt_infile = tb.open_file(filename, mode='r')
+def read_merged_files(destination):
+    """the `merged_files` table of an existing output file; raises `MergeError` if
+    the file has been merged without it"""
+    with tb.open_file(destination, mode="r") as outfile:
+        if "/merged_files" not in outfile:
+            raise MergeError("{} does not list its input files; merge it once without "
+                             "--incremental".format(destination))
+        return outfile.root.merged_files.read()
 
-        if i == 0:
-            pyt_table = pyt_infile.copy_node(
-                where='/', name='reco_events', newparent=outfile.root)
 
-        else:
-            pyt_table_t = pyt_infile.root.reco_events
-            pyt_table_t.append_where(dstTable=pyt_table)
+def select_new_files(filename_list, merged_files):
+    """the files in `filename_list` that are not listed in `merged_files` yet
 
-    print("merged {} files".format(len(filename_list)))
-    return pyt_table
+    files are recognised by their name; if a file with a known name has a different
+    size or modification time than when it was merged, its checksum decides whether
+    it is still the same file -- if not, `MergeError` is raised since its old rows
+    can't be taken out of the output anymore. files merged without `--incremental`
+    have no checksum; for them, any change raises `MergeError`
+    """
+    known = {record["filename"].decode(): record for record in merged_files}
 
+    new_files = []
+    for filename in filename_list:
+        record = known.get(os.path.basename(filename))
+        if record is None:
+            new_files.append(filename)
+            continue
+        stat = os.stat(filename)
+        if stat.st_size == record["size"] and stat.st_mtime == record["mtime"]:
+            continue
+        if not record["md5"] or get_md5(filename) != record["md5"].decode():
+            raise MergeError("{} changed since it was merged; merge all files again "
+                             "without --incremental".format(filename))
+    return new_files
 
-def merge_list_of_pandas(filename_list, destination):
-    store = pd.HDFStore(destination)
-    for i, filename in enumerate(sorted(filename_list)):
-        s = pd.HDFStore(filename)
-        df = pd.read_hdf(filename, 'reco_events')
-        if i == 0:
-            store.put('reco_events', df, format='table', data_columns=True)
-        else:
-            store.append(key='reco_events', value=df, format='table')
-    return store['reco_events']
+
+def append_merged_files(outfile, records):
+    """appends `records` to the `merged_files` table of the open PyTables file"""
+    if "/merged_files" not in outfile:
+        outfile.create_table("/", "merged_files", merged_file_dtype)
+    outfile.root.merged_files.append(records)
+    outfile.flush()
+
+
+def check_row_count(n_written, n_expected, destination):
+    if n_written != n_expected:
+        raise MergeError("{} has {} rows instead of {}".format(
+            destination, n_written, n_expected))
+    print("verified: {} rows".format(n_written))
+
+
+def prepare_merge(filename_list, destination, incremental):
+    """sorts `filename_list` and, for an incremental merge into an existing
+    `destination`, removes the files that are already in there
+
+    Returns
+    -------
+    filename_list : list of strings
+        the files to merge
+    mode : string
+        "a" to append to `destination`, "w" to create it
+    n_rows_before : integer
+        number of rows `destination` already has according to its `merged_files`
+    """
+    filename_list = sorted(filename_list)
+    if not (incremental and os.path.exists(destination)):
+        return filename_list, "w", 0
+
+    merged_files = read_merged_files(destination)
+    new_files = select_new_files(filename_list, merged_files)
+    print("{} of {} files are new".format(len(new_files), len(filename_list)))
+    return new_files, "a", int(merged_files["n_rows"].sum())
+
+
+def merge_list_of_pytables(filename_list, destination, node="reco_events", n_jobs=1,
+                           chunk_size=100000, verify=True, incremental=False):
+    """merges the tables `node` of all files in `filename_list` into one table in
+    `destination`; the rows are written in chunks of `chunk_size` rows
+
+    every merged file is listed in the `merged_files` table of `destination`; with
+    `incremental`, only the files not listed there yet are appended to it, and the
+    checksums of the merged files are stored as well
+    """
+    filename_list, mode, n_rows = prepare_merge(filename_list, destination,
+                                                incremental)
+
+    n_files = 0
+    with tb.open_file(destination, mode=mode) as outfile:
+        pyt_table = outfile.get_node("/", node) if "/" + node in outfile else None
+        for chunk, records in iter_chunks(filename_list, node, n_jobs, chunk_size,
+                                          incremental):
+            if pyt_table is None:
+                pyt_table = outfile.create_table("/", node, chunk.dtype)
+            pyt_table.append(chunk)
+            append_merged_files(outfile, records)
+            n_rows += len(chunk)
+            n_files += len(records)
+
+    print("merged {} of {} files".format(n_files, len(filename_list)))
+    if verify:
+        with tb.open_file(destination, mode="r") as outfile:
+            n_written = outfile.get_node("/", node).nrows if n_rows else 0
+        check_row_count(n_written, n_rows, destination)
+    return n_rows
+
+
+def merge_list_of_pandas(filename_list, destination, node="reco_events", n_jobs=1,
+                         chunk_size=100000, verify=True, incremental=False):
+    """same as `merge_list_of_pytables` but writes a pandas `HDFStore`; all columns
+    are data columns like with `data_columns=True`, but their indexes are only built
+    once all rows are written
+
+    the `merged_files` entries are only written once the store is closed again"""
+    filename_list, mode, n_rows = prepare_merge(filename_list, destination,
+                                                incremental)
+
+    merged_records = []
+    with pd.HDFStore(destination, mode=mode) as store:
+        for chunk, records in iter_chunks(filename_list, node, n_jobs, chunk_size,
+                                          incremental):
+            store.append(node, pd.DataFrame(chunk), format='table',
+                         data_columns=True, index=False)
+            merged_records.append(records)
+            n_rows += len(chunk)
+
+        if merged_records:
+            store.create_table_index(node, optlevel=6, kind="medium")
+        n_written = store.get_storer(node).nrows if n_rows else 0
+
+    n_files = 0
+    if merged_records:
+        merged_records = np.concatenate(merged_records)
+        n_files = len(merged_records)
+        with tb.open_file(destination, mode="a") as outfile:
+            append_merged_files(outfile, merged_records)
+
+    print("merged {} of {} files".format(n_files, len(filename_list)))
+    if verify:
+        check_row_count(n_written, n_rows, destination)
+    return n_rows
 
 
 if __name__ == "__main__":
@@ -57,8 +275,21 @@ if __name__ == "__main__":
     parser.add_argument('--infiles_base', type=str, default="classified_events")
     parser.add_argument('--auto', action='store_true', dest='auto', default=False)
     parser.add_argument('-o', '--outfile', type=str)
+    parser.add_argument('-j', '--n_jobs', type=int, default=1,
+                        help="number of processes reading the input files")
+    parser.add_argument('--chunk_size', type=int, default=100000,
+                        help="number of rows written to the output at once")
+    parser.add_argument('--no_verify', dest='verify', action='store_false',
+                        help="don't compare the row count of the output with the "
+                        "inputs")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only append the input files not yet listed in the "
+                        "output file")
     args = parser.parse_args()
 
+    merge_kwargs = dict(n_jobs=args.n_jobs, chunk_size=args.chunk_size,
+                        verify=args.verify, incremental=args.incremental)
+
     if args.auto:
         for channel in ["gamma", "proton"]:
             for mode in ["wave", "tail"]:
@@ -67,7 +298,8 @@ if __name__ == "__main__":
                     args.infiles_base,
                     channel, mode)
                 merge_list_of_pandas(glob.glob(filename),
-                                     filename.replace("_*", ""))
+                                     filename.replace("_*", ""), **merge_kwargs)
     else:
         merge_list_of_pytables(
-            glob.glob(f"{args.indir}{args.infiles_base}*.h5"), args.outfile)
+            glob.glob(f"{args.indir}{args.infiles_base}*.h5"), args.outfile,
+            **merge_kwargs)
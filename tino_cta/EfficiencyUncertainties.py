@@ -1,8 +1,12 @@
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from numpy import log, exp, pi
 
 from scipy.optimize import minimize
-from scipy.special import loggamma
+from scipy.special import loggamma, betaincinv
 
 from itertools import count
 
@@ -42,10 +46,12 @@ def log_gamma(end, start=1):
         so `end` doesn't neet to be included in sum
 
         if `start` > `end`, return the negative instead
+
+        since log(Γ(end)) - log(Γ(start)) equals that sum for any order of `start` and
+        `end`, this is evaluated through `scipy.special.loggamma` instead of summing
     '''
 
-    return np.sign(end-start) * \
-        np.sum(np.log(np.arange(min(start, end), max(start, end))))
+    return np.real(loggamma(end) - loggamma(start))
 
 
 def P_e(k, N, e):
@@ -157,8 +163,6 @@ def test_func(arg, k, N, conf=.68, de=.001, func=P_e):
     a = arg[0]
     b = get_b_from_a(a, k, N, conf, de, func)
     if b <= 1:
-        test_func.min_a = a
-        test_func.min_b = b
         return b-a
     else:
         return b
@@ -212,20 +216,24 @@ def get_efficiency_uncertainties_minimize(k, N, conf=.68, de=0.0005, func=P_e):
             results[i] = [0, 0, 0, 0, 0]
             continue
 
-        minimize(test_func, [0], args=(_k, _N, conf, de, func), bounds=[(0, 1)],
-                    method='L-BFGS-B', options={'disp': False, 'eps': 1e-3})
+        res = minimize(test_func, [0], args=(_k, _N, conf, de, func), bounds=[(0, 1)],
+                       method='L-BFGS-B', options={'disp': False, 'eps': 1e-3})
+
+        # the edges of the intervall belonging to the optimum found by the minimiser
+        min_a = res.x[0]
+        min_b = get_b_from_a(min_a, _k, _N, conf, de, func)
 
         mean = _k/_N
 
         # if no (all) events passed, the lower (upper) error is zero (one)
-        if _k == 0.: test_func.min_a = 0
-        if _k == _N: test_func.min_b = 1
-        lerr = mean-test_func.min_a
-        herr = test_func.min_b-mean
+        if _k == 0.: min_a = 0
+        if _k == _N or min_b > 1: min_b = 1
+        lerr = mean-min_a
+        herr = min_b-mean
 
         # not sure if it's more useful to return errors as distance from mean or as
         # position on the axis... so do both
-        results[i] = [mean, lerr, herr, test_func.min_a, test_func.min_b]
+        results[i] = [mean, lerr, herr, min_a, min_b]
 
     return results
 
@@ -260,7 +268,217 @@ def get_efficiency_uncertainties_scan(k, N, conf=.68, de=0.0005, func=P_e):
     return mean, lerr, herr, min_a, min_b
 
 
-get_efficiency_uncertainties = get_efficiency_uncertainties_minimize
+def get_efficiency_uncertainties_beta(k, N, conf=.68, n_iter=30):
+    """
+    same as `get_efficiency_uncertainties_minimize` but for whole arrays of `k` and `N`
+    at once and without numerical integration
+
+    `P_e` is the density of a beta distribution with parameters `k+1` and `N-k+1`, so
+    an intervall [a, b] with coverage `conf` is given by the quantiles
+    a = F^-1(p) and b = F^-1(p + conf) for any p in [0, 1-conf]. The length b-a is
+    unimodal in p, so the shortest intervall is found by a golden-section search on p
+    that runs for all bins at once.
+
+    Parameters
+    ----------
+    k, N : integers or numpy arrays
+        passed / total number of events for efficiency calculation
+    conf : float, optional (default: 0.68)
+        confidence intervall coverage
+    n_iter : integer, optional (default: 30)
+        number of steps of the golden-section search; every step shrinks the search
+        range by a factor of 0.618
+
+    Returns
+    -------
+    results : shape (x,5) numpy array
+        same content as for `get_efficiency_uncertainties_minimize`:
+        mean, lerr, herr, min_a, min_b
+    """
+
+    np_k = np.array(k, ndmin=1, dtype=float)
+    np_N = np.array(N, ndmin=1, dtype=float)
+
+    assert np_k.shape == np_N.shape, "k and N need to be of same dimension"
+
+    results = np.zeros((len(np_k), 5))
+
+    valid = np_N > 0
+    k_valid, N_valid = np_k[valid], np_N[valid]
+    alpha, beta = k_valid + 1, N_valid - k_valid + 1
+
+    def interval_edges(p):
+        return betaincinv(alpha, beta, p), betaincinv(alpha, beta, np.minimum(p + conf, 1))
+
+    def interval_length(p):
+        a, b = interval_edges(p)
+        return b - a
+
+    golden = (np.sqrt(5) - 1) / 2
+    low = np.zeros_like(alpha)
+    high = np.full_like(alpha, 1 - conf)
+    p_c = high - golden * (high - low)
+    p_d = low + golden * (high - low)
+    len_c = interval_length(p_c)
+    len_d = interval_length(p_d)
+    for i in range(n_iter):
+        # keep the side of the better point; its other point becomes the new inner one
+        left = len_c < len_d
+        high = np.where(left, p_d, high)
+        low = np.where(left, low, p_c)
+        p_new = np.where(left, high - golden * (high - low), low + golden * (high - low))
+        len_new = interval_length(p_new)
+
+        p_c, p_d = np.where(left, p_new, p_d), np.where(left, p_c, p_new)
+        len_c, len_d = np.where(left, len_new, len_d), np.where(left, len_c, len_new)
+
+    # if no (all) events passed, the intervall starts at zero (ends at one)
+    p_best = (low + high) / 2
+    p_best[k_valid == 0] = 0
+    p_best[k_valid == N_valid] = 1 - conf
+    min_a, min_b = interval_edges(p_best)
+    min_a[k_valid == 0] = 0
+    min_b[k_valid == N_valid] = 1
+
+    mean = k_valid / N_valid
+    results[valid] = np.stack([mean, mean - min_a, min_b - mean, min_a, min_b], axis=-1)
+
+    return results
+
+
+class EfficiencyIntervalCache:
+    """
+    memoised, thread-safe front end of `get_efficiency_uncertainties_beta`
+
+    the results for all pairs with `N <= n_table` are computed in one go the first time
+    they are asked for (per `conf`) and then looked up in a table; pairs with larger `N`
+    are computed on demand and kept in a buffer that drops the least recently used
+    entries beyond `maxsize`
+
+    Parameters
+    ----------
+    n_table : integer, optional (default: 100)
+        largest `N` covered by the precomputed tables
+    maxsize : integer, optional (default: 100000)
+        maximum number of (k, N, conf) entries kept outside the tables
+    path : string, optional (default: None)
+        `.npz` file to read the tables and entries from; `save` writes it back
+    """
+
+    def __init__(self, n_table=100, maxsize=100000, path=None):
+        self.n_table = n_table
+        self.maxsize = maxsize
+        self.path = path
+        self.tables = {}
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def get_table(self, conf=.68):
+        """returns the table of the results of all pairs up to `N = n_table`;
+        `table[N, k]` holds the 5 values for the pair (k, N)"""
+        with self._lock:
+            if conf not in self.tables:
+                N, k = np.meshgrid(np.arange(self.n_table + 1),
+                                   np.arange(self.n_table + 1), indexing="ij")
+                valid = k <= N
+                table = np.zeros(N.shape + (5,))
+                table[valid] = get_efficiency_uncertainties_beta(k[valid], N[valid],
+                                                                 conf)
+                self.tables[conf] = table
+            return self.tables[conf]
+
+    def __call__(self, k, N, conf=.68):
+        """same as `get_efficiency_uncertainties_beta(k, N, conf)`"""
+        np_k = np.array(k, ndmin=1)
+        np_N = np.array(N, ndmin=1)
+
+        assert np_k.shape == np_N.shape, "k and N need to be of same dimension"
+
+        results = np.zeros((len(np_k), 5))
+
+        # the tables only cover integer pairs
+        in_table = (np_N <= self.n_table) & (np_N == np.floor(np_N)) \
+            & (np_k == np.floor(np_k)) & (0 <= np_k) & (np_k <= np_N)
+        if np.any(in_table):
+            results[in_table] = self.get_table(conf)[np_N[in_table].astype(int),
+                                                     np_k[in_table].astype(int)]
+
+        with self._lock:
+            self.hits += np.count_nonzero(in_table)
+
+            missing = OrderedDict()
+            for i in np.flatnonzero(~in_table):
+                key = (np_k[i].item(), np_N[i].item(), conf)
+                try:
+                    results[i] = self.entries[key]
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                except KeyError:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                self.misses += len(missing)
+                k_missing, N_missing, _ = zip(*missing)
+                new_results = get_efficiency_uncertainties_beta(k_missing, N_missing,
+                                                                conf)
+                for (key, indices), result in zip(missing.items(), new_results):
+                    results[indices] = result
+                    self.entries[key] = result
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+
+        return results
+
+    def clear(self):
+        with self._lock:
+            self.tables.clear()
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def save(self, path=None):
+        """writes the tables and the buffered entries into an `.npz` file"""
+        path = path or self.path
+        with self._lock:
+            keys = np.array(list(self.entries.keys()), dtype=float).reshape(-1, 3)
+            values = np.array(list(self.entries.values())).reshape(-1, 5)
+            confs = sorted(self.tables)
+            np.savez_compressed(path, keys=keys, values=values,
+                                n_table=self.n_table, confs=confs,
+                                **{"table_{}".format(i): self.tables[conf]
+                                   for i, conf in enumerate(confs)})
+
+    def load(self, path=None):
+        """reads the tables and entries written by `save` into the cache"""
+        path = path or self.path
+        with np.load(path) as data, self._lock:
+            if data["n_table"] == self.n_table:
+                for i, conf in enumerate(data["confs"]):
+                    self.tables[float(conf)] = data["table_{}".format(i)]
+            for (k, N, conf), result in zip(data["keys"], data["values"]):
+                self.entries[(k.item(), N.item(), conf.item())] = result
+
+
+efficiency_cache = EfficiencyIntervalCache()
+
+
+def get_efficiency_uncertainties(k, N, conf=.68):
+    """
+    calculates the mean and confidence intervall of the selection efficiency from `k`
+    selected out of `N` total events; cf. `get_efficiency_uncertainties_beta` -- the
+    results are memoised in `efficiency_cache`
+
+    Returns
+    -------
+    results : shape (x,5) numpy array
+        mean, lerr, herr, min_a, min_b for every pair of `k` and `N`
+    """
+    return efficiency_cache(k, N, conf)
 
 
 if __name__ == "__main__":
@@ -45,12 +45,32 @@ class nDHistogram:
         return bins
 
     def fill(self, args, value=1):
-        bins = self.find_bins(args)
+        bins = tuple(self.find_bins(args))
         self.data[bins] += value
         self.norm[bins] += 1
 
+    def fill_many(self, args, values=1):
+        """fills many entries at once
+
+        Parameters
+        ----------
+        args : list of arrays
+            one array of coordinates per axis; all of the same length
+        values : array or scalar (default: 1)
+            the weight of every entry
+        """
+        # digitise every axis at once (converting its units only once) and turn the
+        # bin numbers into indices of the flattened histogram
+        flat_bins = np.ravel_multi_index(self.find_bins(args), self.data.shape)
+        values = np.broadcast_to(values, flat_bins.shape)
+
+        self.data += np.bincount(flat_bins, weights=values,
+                                 minlength=self.data.size).reshape(self.data.shape)
+        self.norm += np.bincount(flat_bins,
+                                 minlength=self.norm.size).reshape(self.norm.shape)
+
     def evaluate(self, args):
-        return self.data[ self.find_bins(args) ]
+        return self.data[tuple(self.find_bins(args))]
 
     def interpolate(self, args, out_of_bounds_value=0., order=3):
         bins_u = np.array(self.find_bins(args))
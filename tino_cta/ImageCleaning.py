@@ -1,15 +1,23 @@
+import os
+import warnings
+
 import numpy as np
 
 from scipy import ndimage
 
 from ctapipe.utils.CutFlow import CutFlow
 
-from ctapipe.image.cleaning import tailcuts_clean, dilate
-from ctapipe.image.geometry_converter import (convert_geometry_hex1d_to_rect2d,
-                                              convert_geometry_rect2d_back_to_hexe1d,
-                                              astri_to_2d_array, array_2d_to_astri,
+from ctapipe.image.geometry_converter import (astri_to_2d_array, array_2d_to_astri,
                                               chec_to_2d_array, array_2d_to_chec)
 
+from tino_cta import geometry_converter
+from tino_cta.geometry_converter import (convert_geometry_hex1d_to_rect2d,
+                                         convert_geometry_rect2d_back_to_hexe1d,
+                                         get_geometry_hash, GeometryCache,
+                                         read_transfer_maps, write_transfer_maps)
+from tino_cta.tailcut import (get_neighbour_matrix, tailcuts_clean_batch,
+                              dilate_batch, largest_island_batch)
+
 from datapipe.denoising.wavelets_mrfilter import WaveletTransform
 from datapipe.denoising import cdf
 from datapipe.denoising.inverse_transform_sampling import \
@@ -47,21 +55,89 @@ def kill_isolpix(array, neighbours=None, threshold=.2):
     filtered_array : 2D array
         image with just the largest island remaining
     """
+    filtered_array = np.copy(array)[None, ...]
+    return kill_isolpix_batch(filtered_array, neighbours, threshold,
+                              out=filtered_array)[0]
+
+
+def kill_isolpix_batch(arrays, neighbours=None, threshold=.2, out=None):
+    """same as `kill_isolpix` but for a whole stack of images
+
+    All images are labelled in one go on a 3D grid without any connectivity along the
+    stack axis; the sums of all islands come from one `np.bincount`.
+
+    Parameters
+    ----------
+    arrays : 3D array
+        the stack of images with shape `(n_images, ny, nx)`
+    neighbours : 2D array, optional (default: None)
+        a mask defining what is considered a neighbour within an image
+    threshold : float, optional (default: 0.2)
+        ignores pixel with entries below this value
+    out : 3D float array, optional (default: None)
+        array to write the result into; can be `arrays` itself to filter the images
+        in place
+
+    Returns
+    -------
+    filtered_arrays : 3D array
+        the images with just their largest island remaining
+    """
+    if out is None:
+        out = np.array(arrays, dtype=float)
+    elif out is not arrays:
+        out[...] = arrays
+    if out.size == 0:
+        return out
 
-    filtered_array = np.copy(array)
+    if neighbours is None:
+        neighbours = ndimage.generate_binary_structure(2, 1)
+    structure = np.zeros((3,) + np.shape(neighbours), dtype=bool)
+    structure[1] = neighbours
 
-    filtered_array[filtered_array < threshold] = 0
-    mask = filtered_array > 0
+    out[out < threshold] = 0
+    label_im, nb_labels = ndimage.label(out > 0, structure)
 
-    label_im, nb_labels = ndimage.label(mask, neighbours)
+    # the labels are unique over the whole stack; find the image of every label
+    # and the largest sum of any island in each image (at least 0, like the
+    # background)
+    sums = np.bincount(label_im.ravel(), weights=out.ravel(),
+                       minlength=nb_labels + 1)
+    label_image = np.zeros(nb_labels + 1, dtype=int)
+    label_image[label_im] = np.arange(len(out))[:, None, None]
+    max_sums = np.zeros(len(out))
+    np.maximum.at(max_sums, label_image[1:], sums[1:])
 
-    sums = ndimage.sum(filtered_array, label_im, range(nb_labels + 1))
-    mask_sum = sums < np.max(sums)
-    remove_pixel = mask_sum[label_im]
+    remove_label = sums < max_sums[label_image]
+    remove_label[0] = False
+    out[remove_label[label_im]] = 0
 
-    filtered_array[remove_pixel] = 0
+    return out
 
-    return filtered_array
+
+# buffer of the edge pixels of the cameras, keyed by the content of the geometry (cf.
+# `get_geometry_hash`) and the width of the edge
+edge_pixel_buffer = GeometryCache(maxsize=128)
+
+
+def get_edge_pixel_path(geom_hash, rows, n_neigh, cam_id=""):
+    return os.path.join(geometry_converter.transfer_map_dir, "{}_{}_edge_{}_{}.npz".format(
+        cam_id, geom_hash, rows, n_neigh))
+
+
+def make_edge_pixels(camera, rows=1, n_neigh=None):
+    """does the actual work of `get_edge_pixels`"""
+    neighbour_matrix = get_neighbour_matrix(camera)
+
+    # the first row consists of all pixels that have less than the nominal number of
+    # neighbours -- which is 6 for hexagonal pixels and 4 for rectangular ones
+    edge = np.diff(neighbour_matrix.indptr) < n_neigh
+
+    # add more rows by adding the neighbours of all pixels of the edge so far
+    for i in range(rows-1):
+        edge |= neighbour_matrix.dot(edge.astype(np.int32)) > 0
+
+    return np.flatnonzero(edge)
 
 
 def get_edge_pixels(camera, rows=1, n_neigh=None):
@@ -80,29 +156,34 @@ def get_edge_pixels(camera, rows=1, n_neigh=None):
 
     Returns
     -------
-        python set of pixel IDs to consider "the edge" of the image
-        edge_pixels : set
+    edge_pixels : 1D integer array
+        the sorted IDs of the pixels to consider "the edge" of the image
 
     Note
     ----
-    `edge_pixels` is stored as a member of `camera`, since the same camera geometry will
-    show up many times
+    `edge_pixels` is buffered in `edge_pixel_buffer` and -- if
+    `geometry_converter.transfer_map_dir` is set -- written next to the transfer maps
+    on disk, since the same camera geometry will show up many times
     """
-    if not hasattr(camera, "edge_pixels"):
-        # the first row consists of all pixels that have less than the nominal number of
-        # neighbours -- which is 6 for hexagonal pixels and 4 for rectangular ones
-        n_neigh = n_neigh or (6 if "hex" in camera.pix_type else 4)
-        edge_pixels = set(id for id, neigh in zip(camera.pix_id, camera.neighbors)
-                          if len(neigh) < n_neigh)
-
-        # add more rows by joining `edge_pixels` with the sets of the neighbours of all
-        # pixels in `edge_pixels`
-        for i in range(rows-1):
-            for j in list(edge_pixels):
-                edge_pixels |= set(camera.neighbors[j])
+    n_neigh = n_neigh or (6 if "hex" in camera.pix_type else 4)
+    geom_hash = get_geometry_hash(camera)
+
+    def load_or_make():
+        if geometry_converter.transfer_map_dir is None:
+            return make_edge_pixels(camera, rows, n_neigh)
+
+        path = get_edge_pixel_path(geom_hash, rows, n_neigh, camera.cam_id)
+        stored = read_transfer_maps(path)
+        if stored is not None:
+            return stored["edge_pixels"]
+        edge_pixels = make_edge_pixels(camera, rows, n_neigh)
+        try:
+            write_transfer_maps(path, {"edge_pixels": edge_pixels})
+        except OSError as e:
+            print("could not write edge pixels to {}: {}".format(path, e))
+        return edge_pixels
 
-        camera.edge_pixels = np.array(list(edge_pixels), dtype=int)
-    return camera.edge_pixels
+    return edge_pixel_buffer.get_or_create((geom_hash, rows, n_neigh), load_or_make)
 
 
 def reject_edge_event(img, geom, rel_thresh=5., abs_thresh=None, rows=1):
@@ -113,7 +194,7 @@ def reject_edge_event(img, geom, rel_thresh=5., abs_thresh=None, rows=1):
     Parameters
     ----------
     img : ndarray
-        the camera image
+        the camera image -- or a 2D stack of camera images, one per row
     geom : ctapipe CameraGeometry object
         the camera geometry object
     rel_thresh : float, optional (default: 5.)
@@ -125,12 +206,14 @@ def reject_edge_event(img, geom, rel_thresh=5., abs_thresh=None, rows=1):
 
     Returns
     -------
-    reject : bool
+    reject : bool or 1D boolean array
         whether or not any of the edge pixels has a signal higher than the threshold
+        (for every image in the stack)
     """
-    edge_thresh = abs_thresh or (np.max(img)/rel_thresh)
+    img = np.asarray(img)
+    edge_thresh = abs_thresh or (np.max(img, axis=-1, keepdims=True)/rel_thresh)
     edge_pixels = get_edge_pixels(geom, rows=rows)
-    return (img[edge_pixels] > edge_thresh).any()
+    return (img[..., edge_pixels] > edge_thresh).any(axis=-1)
 
 
 class ImageCleaner:
@@ -155,7 +238,7 @@ class ImageCleaner:
     def __init__(self, mode="wave", dilate=False, island_cleaning=True,
                  skip_edge_events=True, edge_width=1,
                  cutflow=CutFlow("ImageCleaner"),
-                 wavelet_options=None,
+                 wavelet_options=None, wavelet_backend="mrfilter",
                  tmp_files_directory='/dev/shm/', mrfilter_directory=None):
         self.mode = mode
         self.edge_width = edge_width
@@ -171,12 +254,38 @@ class ImageCleaner:
             self.clean = self.clean_none
         elif mode.startswith("wave"):
             self.clean = self.clean_wave
-            self.wavelet_cleaning = \
-                lambda *arg, **kwargs: WaveletTransform().clean_image(
-                                *arg, **kwargs,
-                                kill_isolated_pixels=island_cleaning,
-                                tmp_files_directory=tmp_files_directory,
-                                mrfilter_directory=mrfilter_directory)
+            if wavelet_backend == "mrfilter":
+                # writes FITS files and calls the `mr_filter` executable per image
+                self.wavelet_cleaning = \
+                    lambda *arg, **kwargs: WaveletTransform().clean_image(
+                                    *arg, **kwargs,
+                                    kill_isolated_pixels=island_cleaning,
+                                    tmp_files_directory=tmp_files_directory,
+                                    mrfilter_directory=mrfilter_directory)
+                # `mr_filter` only takes one image per call; loop over the stack
+                self.wavelet_batch_cleaning = \
+                    lambda imgs, *arg, **kwargs: np.array(
+                        [self.wavelet_cleaning(img, *arg, **kwargs) for img in imgs])
+            elif wavelet_backend == "numpy":
+                # same filtering, done in memory on the numpy arrays -- experimental:
+                # not validated against reference outputs of `mr_filter` yet, so only
+                # selectable from the sandbox scripts, not the production ones
+                warnings.warn("the numpy wavelet backend is experimental; its results "
+                              "have not been validated against mr_filter")
+                from tino_cta.starlet import StarletFilter
+                starlet_filter = StarletFilter()
+                self.wavelet_cleaning = \
+                    lambda *arg, **kwargs: starlet_filter.clean_image(
+                                    *arg, **kwargs,
+                                    kill_isolated_pixels=island_cleaning)
+                # filters the whole stack at once
+                self.wavelet_batch_cleaning = \
+                    lambda *arg, **kwargs: starlet_filter.clean_images(
+                                    *arg, **kwargs,
+                                    kill_isolated_pixels=island_cleaning)
+            else:
+                raise UnknownMode(
+                    'wavelet backend "{}" not found'.format(wavelet_backend))
             self.island_threshold = 1.5
 
             # command line parameters for the mr_filter call
@@ -222,10 +331,14 @@ class ImageCleaner:
 
         if island_cleaning:
             self.island_cleaning = kill_isolpix
+            self.island_cleaning_batch = kill_isolpix_batch
+            self.island_cleaning_1d = largest_island_batch
         else:
             # just a pass-through that does nothing
             # (saves an if-statement in every `clean` call)
             self.island_cleaning = lambda x, *args, **kw: x
+            self.island_cleaning_batch = lambda x, *args, **kw: x
+            self.island_cleaning_1d = lambda geom, x, *args, **kw: x
 
     def clean_wave(self, img, cam_geom):
         if cam_geom.pix_type.startswith("hex"):
@@ -242,88 +355,158 @@ class ImageCleaner:
 
         return new_img, new_geom
 
+    def clean_batch(self, imgs, cam_geom):
+        """cleans a whole stack of images of the same camera type -- e.g. of all
+        telescopes of that type in one event or of many events
+
+        Parameters
+        ----------
+        imgs : list or 2D array
+            the 1D camera images to clean
+        cam_geom : ctapipe CameraGeometry object
+            the camera geometry all the images belong to
+
+        Returns
+        -------
+        cleaned : list
+            a `(new_img, new_geom)` tuple for every image in `imgs` -- or `None` if the
+            image has been rejected as an edge event
+        """
+        if self.clean == self.clean_wave:
+            return self.clean_wave_batch(imgs, cam_geom)
+        if self.clean == self.clean_tail:
+            return self.clean_tail_batch(imgs, cam_geom)
+
+        cleaned = []
+        for img in imgs:
+            try:
+                cleaned.append(self.clean(np.array(img), cam_geom))
+            except EdgeEvent:
+                cleaned.append(None)
+        return cleaned
+
+    def clean_wave_batch(self, imgs, cam_geom):
+        """same as `clean_wave` but for a stack of images; cf. `clean_batch`"""
+        if cam_geom.pix_type.startswith("hex"):
+            new_imgs, new_geom = self.clean_wave_hex_batch(imgs, cam_geom)
+        elif cam_geom.pix_type.startswith("rect"):
+            new_imgs, new_geom = self.clean_wave_rect_batch(imgs, cam_geom)
+        else:
+            raise MissingImplementation("wavelet cleaning not yet implemented"
+                                        " for geometry {}".format(cam_geom.cam_id))
+
+        return self.cut_edge_events(new_imgs, new_geom)
+
     def clean_wave_rect(self, img, cam_geom):
+        new_imgs, new_geom = self.clean_wave_rect_batch([img], cam_geom)
+        return new_imgs[0], new_geom
+
+    def clean_wave_rect_batch(self, imgs, cam_geom):
         try:
-            array2d_img = self.geom_1d_to_2d[cam_geom.cam_id](img)
+            array2d_imgs = np.array([self.geom_1d_to_2d[cam_geom.cam_id](img)
+                                     for img in imgs])
         except KeyError:
             raise MissingImplementation("wavelet cleaning not yet implemented"
                                         " for geometry {}".format(cam_geom.cam_id))
 
-        cleaned_img = self.wavelet_cleaning(
-                array2d_img, raw_option_string=self.wavelet_options[cam_geom.cam_id],
+        cleaned_imgs = self.wavelet_batch_cleaning(
+                array2d_imgs, raw_option_string=self.wavelet_options[cam_geom.cam_id],
                 noise_distribution=self.noise_model[cam_geom.cam_id])
 
-        self.cutflow.count("wavelet cleaning")
+        self.cutflow.count("wavelet cleaning", weight=len(cleaned_imgs))
 
         # wavelet_transform still leaves some isolated pixels; remove them
-        cleaned_img = self.island_cleaning(cleaned_img)
+        cleaned_imgs = np.asarray(cleaned_imgs, dtype=float)
+        cleaned_imgs = self.island_cleaning_batch(cleaned_imgs, out=cleaned_imgs)
 
-        new_img = self.geom_2d_to_1d[cam_geom.cam_id](cleaned_img)
+        new_imgs = []
+        for cleaned_img in cleaned_imgs:
+            new_imgs.append(self.geom_2d_to_1d[cam_geom.cam_id](cleaned_img))
         new_geom = cam_geom
 
-        return new_img, new_geom
+        return new_imgs, new_geom
 
     def clean_wave_hex(self, img, cam_geom):
-        rot_geom, rot_img = convert_geometry_hex1d_to_rect2d(
-                                cam_geom, img, cam_geom.cam_id)
+        unrot_imgs, unrot_geom = self.clean_wave_hex_batch([img], cam_geom)
+        return unrot_imgs[0], unrot_geom
+
+    def clean_wave_hex_batch(self, imgs, cam_geom):
+        rot_imgs = []
+        for img in imgs:
+            rot_geom, rot_img = convert_geometry_hex1d_to_rect2d(
+                                    cam_geom, img, cam_geom.cam_id)
+            rot_imgs.append(rot_img)
 
-        cleaned_img = self.wavelet_cleaning(
-                rot_img, raw_option_string=self.wavelet_options[cam_geom.cam_id],
+        cleaned_imgs = self.wavelet_batch_cleaning(
+                np.array(rot_imgs),
+                raw_option_string=self.wavelet_options[cam_geom.cam_id],
                 noise_distribution=self.noise_model[cam_geom.cam_id])
 
-        self.cutflow.count("wavelet cleaning")
+        self.cutflow.count("wavelet cleaning", weight=len(cleaned_imgs))
 
-        cleaned_img = self.island_cleaning(cleaned_img,
-                                           neighbours=self.hex_neighbours_1ring,
-                                           threshold=self.island_threshold)
+        cleaned_imgs = np.asarray(cleaned_imgs, dtype=float)
+        cleaned_imgs = self.island_cleaning_batch(cleaned_imgs,
+                                                  neighbours=self.hex_neighbours_1ring,
+                                                  threshold=self.island_threshold,
+                                                  out=cleaned_imgs)
 
-        unrot_geom, unrot_img = convert_geometry_rect2d_back_to_hexe1d(
-            rot_geom, cleaned_img, cam_geom.cam_id)
+        unrot_imgs = []
+        for cleaned_img in cleaned_imgs:
+            unrot_geom, unrot_img = convert_geometry_rect2d_back_to_hexe1d(
+                rot_geom, cleaned_img, cam_geom.cam_id)
+            unrot_imgs.append(unrot_img)
 
-        return unrot_img, unrot_geom
+        return unrot_imgs, unrot_geom
 
     def clean_tail(self, img, cam_geom):
-        mask = tailcuts_clean(
-                cam_geom, img,
+        cleaned = self.clean_tail_batch([img], cam_geom)[0]
+        if cleaned is None:
+            raise EdgeEvent
+        return cleaned
+
+    def clean_tail_batch(self, imgs, cam_geom):
+        """same as `clean_tail` but for a stack of images; cf. `clean_batch`
+
+        The tailcut selection, the dilation and (except for ASTRI) the island cleaning
+        are done on the 1D images with the sparse neighbour matrix of the camera; cf.
+        `tino_cta.tailcut`.
+        """
+        imgs = np.array(imgs, dtype=float)
+        masks = tailcuts_clean_batch(
+                cam_geom, imgs,
                 picture_thresh=self.tail_thresholds[cam_geom.cam_id][1],
                 boundary_thresh=self.tail_thresholds[cam_geom.cam_id][0])
         if self.dilate:
-            dilate(cam_geom, mask)
-        img[~mask] = 0
+            masks = dilate_batch(cam_geom, masks)
+        imgs[~masks] = 0
 
-        self.cutflow.count("tailcut cleaning")
+        self.cutflow.count("tailcut cleaning", weight=len(imgs))
 
         if "ASTRI" in cam_geom.cam_id:
-            # turn into 2d to apply island cleaning
-            img = astri_to_2d_array(img)
-
-            # if set, remove all signal patches but the biggest one
-            new_img = self.island_cleaning(img)
-
-            # turn back into 1d array
-            new_img = array_2d_to_astri(new_img)
-            new_geom = cam_geom
-
+            # turn into 2d to apply island cleaning, then back into 1d
+            new_imgs = [array_2d_to_astri(self.island_cleaning(astri_to_2d_array(img)))
+                        for img in imgs]
         else:
-            # turn into 2d to apply island cleaning
-            rot_geom, rot_img = convert_geometry_hex1d_to_rect2d(
-                                    cam_geom, img, cam_geom.cam_id)
-
             # if set, remove all signal patches but the biggest one
-            cleaned_img = self.island_cleaning(rot_img, self.hex_neighbours_1ring)
-
-            # turn back into 1d array
-            unrot_geom, unrot_img = convert_geometry_rect2d_back_to_hexe1d(
-                rot_geom, cleaned_img, cam_geom.cam_id)
-
-            new_img = unrot_img
-            new_geom = unrot_geom
-
-        if self.cutflow.cut("edge event",
-                            img=new_img, geom=new_geom, rows=self.edge_width):
-            raise EdgeEvent
-
-        return new_img, new_geom
+            new_imgs = self.island_cleaning_1d(cam_geom, imgs)
+
+        return self.cut_edge_events(new_imgs, cam_geom)
+
+    def cut_edge_events(self, new_imgs, new_geom):
+        """applies the "edge event" cut to all cleaned images of a stack at once
+
+        Returns
+        -------
+        cleaned : list
+            a `(new_img, new_geom)` tuple for every image in `new_imgs` -- or `None` if
+            the image has been rejected as an edge event
+        """
+        reject = np.broadcast_to(
+            self.reject_edge_event(np.asarray(new_imgs), new_geom, rows=self.edge_width),
+            (len(new_imgs),))
+        self.cutflow.count("edge event", weight=np.count_nonzero(~reject))
+        return [None if rejected else (new_img, new_geom)
+                for new_img, rejected in zip(new_imgs, reject)]
 
     def clean_none(self, img, cam_geom):
         return img, cam_geom
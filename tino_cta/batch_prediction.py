@@ -0,0 +1,146 @@
+"""batched versions of `EventClassifier.predict_proba_by_event` and
+`EnergyRegressor.predict_by_event`
+
+ctapipe's wrappers call the scikit-learn model of every camera type once per event with
+only the few images of that event. Here, the images of many events are stacked into one
+feature matrix per camera type, every model is called only once and the predictions are
+averaged per event afterwards -- with the same weights ctapipe uses, i.e.
+`sum_signal_cam / impact_dist` if the features are given as namedtuples with these
+fields, 1 otherwise.
+"""
+
+import numpy as np
+
+
+__all__ = ["predict_proba_batch", "predict_energy_batch"]
+
+
+def stack_features(feature_events, model_dict):
+    """collects the image features of a list of events into one matrix per camera type
+
+    Parameters
+    ----------
+    feature_events : list of dictionaries
+        one dictionary per event, mapping `cam_id` to the list of the feature tuples
+        of the images of that camera type
+    model_dict : dictionary
+        the models per `cam_id`; cameras without a model are skipped
+
+    Returns
+    -------
+    features : dictionary of 2D arrays
+        the stacked features per `cam_id`
+    event_index : dictionary of 1D arrays
+        the position in `feature_events` of the event each row belongs to
+    weights : dictionary of 1D arrays
+        the weight of each row in the average over the images of an event
+    """
+    feature_lists = {}
+    index_lists = {}
+    for i, feature_evt in enumerate(feature_events):
+        for cam_id, tels in feature_evt.items():
+            if cam_id not in model_dict:
+                continue
+            feature_lists.setdefault(cam_id, []).extend(tels)
+            index_lists.setdefault(cam_id, []).extend([i] * len(tels))
+
+    features, event_index, weights = {}, {}, {}
+    for cam_id, tels in feature_lists.items():
+        features[cam_id] = np.array(tels, dtype=float)
+        event_index[cam_id] = np.array(index_lists[cam_id])
+
+        fields = getattr(tels[0], "_fields", ())
+        if "sum_signal_cam" in fields and "impact_dist" in fields:
+            weights[cam_id] = features[cam_id][:, fields.index("sum_signal_cam")] \
+                / features[cam_id][:, fields.index("impact_dist")]
+        else:
+            weights[cam_id] = np.ones(len(tels))
+
+    return features, event_index, weights
+
+
+def average_by_event(predictions, event_index, weights, n_events):
+    """weighted average of the image-wise `predictions` of every event
+
+    Parameters
+    ----------
+    predictions, event_index, weights : dictionaries of arrays
+        per `cam_id`: the predictions (1D or 2D with one row per image), the event
+        every image belongs to and its weight
+    n_events : integer
+        total number of events
+
+    Returns
+    -------
+    average : 1D or 2D array
+        the average per event; NaN for events without any image
+    """
+    predictions = np.concatenate([predictions[c] for c in sorted(predictions)])
+    event_index = np.concatenate([event_index[c] for c in sorted(event_index)])
+    weights = np.concatenate([weights[c] for c in sorted(weights)])
+
+    sum_weights = np.bincount(event_index, weights, minlength=n_events)
+    if predictions.ndim == 1:
+        sum_predictions = np.bincount(event_index, weights * predictions,
+                                      minlength=n_events)
+    else:
+        sum_predictions = np.stack(
+            [np.bincount(event_index, weights * column, minlength=n_events)
+             for column in predictions.T], axis=-1)
+        sum_weights = sum_weights[:, None]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sum_predictions / sum_weights
+
+
+def predict_proba_batch(classifier, feature_events):
+    """same as `classifier.predict_proba_by_event(feature_events)` but with only one
+    call of `predict_proba` per camera type
+
+    Parameters
+    ----------
+    classifier : `ctapipe.reco.event_classifier.EventClassifier`
+        the trained classifier
+    feature_events : list of dictionaries
+        cf. `stack_features`
+
+    Returns
+    -------
+    predict_proba : 2D array
+        the averaged class probabilities, one row per event
+    """
+    if not feature_events:
+        return np.empty((0, 2))
+
+    features, event_index, weights = stack_features(feature_events,
+                                                    classifier.model_dict)
+    predictions = {cam_id: classifier.model_dict[cam_id].predict_proba(cam_features)
+                   for cam_id, cam_features in features.items()}
+    return average_by_event(predictions, event_index, weights, len(feature_events))
+
+
+def predict_energy_batch(regressor, feature_events):
+    """same as `regressor.predict_by_event(feature_events)["mean"]` but with only one
+    call of `predict` per camera type
+
+    Parameters
+    ----------
+    regressor : `ctapipe.reco.energy_regressor.EnergyRegressor`
+        the trained regressor
+    feature_events : list of dictionaries
+        cf. `stack_features`
+
+    Returns
+    -------
+    energy : astropy.Quantity
+        the weighted mean of the energy estimates of every event
+    """
+    if not feature_events:
+        return np.empty(0) * regressor.energy_unit
+
+    features, event_index, weights = stack_features(feature_events,
+                                                    regressor.model_dict)
+    predictions = {cam_id: regressor.model_dict[cam_id].predict(cam_features)
+                   for cam_id, cam_features in features.items()}
+    return average_by_event(predictions, event_index, weights, len(feature_events)) \
+        * regressor.energy_unit
@@ -0,0 +1,277 @@
+"""compact, pickle-free representation of the random forests of an `EventClassifier`
+or `EnergyRegressor`
+
+The nodes of all trees of a forest are concatenated into a few flat arrays (children,
+split feature, threshold and leaf value) that are written into one `.npz` file per
+camera type. The thresholds are stored in single precision, which is what the
+features are compared in anyway; the leaf values keep their double precision, so the
+predictions are the same as the ones of scikit-learn. Loading such a file is a plain
+`np.load`, and the trees are walked down for a whole batch of images
+in one compiled loop.
+
+`CompactForest` has the `predict` / `predict_proba` methods of the scikit-learn models
+and `CompactModel` the `model_dict` (and `energy_unit`) of the ctapipe wrappers, so
+they can be used with `tino_cta.batch_prediction` directly.
+"""
+
+import numpy as np
+from astropy import units as u
+from numba import jit
+
+
+__all__ = ["CompactForest", "CompactModel"]
+
+
+def float32_floor(values):
+    """rounds `values` down to the next single-precision number
+
+    The trees compare single-precision features with double-precision thresholds;
+    with the thresholds rounded down, `x <= threshold` gives the same answer for
+    every single-precision `x`.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values32 = values.astype(np.float32)
+    too_high = values32 > values
+    values32[too_high] = np.nextafter(values32[too_high], np.float32(-np.inf))
+    return values32
+
+
+@jit(nopython=True, nogil=True)
+def _find_leaf(x, node, left, right, feature, threshold):
+    """walks down the tree starting at `node` for the features `x` of one sample"""
+    while left[node] != node:
+        if x[feature[node]] <= threshold[node]:
+            node = left[node]
+        else:
+            node = right[node]
+    return node
+
+
+@jit(nopython=True, nogil=True)
+def _walk_trees(X, left, right, feature, threshold, roots, leaves):
+    """puts the leaf every row of `X` ends up in for every tree into `leaves`"""
+    # one tree after the other, so that the nodes of the current tree stay in cache
+    for j in range(roots.shape[0]):
+        for i in range(X.shape[0]):
+            leaves[i, j] = _find_leaf(X[i], roots[j], left, right, feature, threshold)
+
+
+@jit(nopython=True, nogil=True)
+def _sum_leaf_values(X, left, right, feature, threshold, roots, value, result):
+    """adds the (2D) `value` of the leaves every row of `X` ends up in to `result`"""
+    for j in range(roots.shape[0]):
+        for i in range(X.shape[0]):
+            node = _find_leaf(X[i], roots[j], left, right, feature, threshold)
+            for k in range(value.shape[1]):
+                result[i, k] += value[node, k]
+
+
+class CompactForest:
+    """flattened version of a fitted `RandomForestClassifier` or
+    `RandomForestRegressor`
+
+    Parameters
+    ----------
+    left, right : 1D integer arrays
+        index of the left and right child of every node; leaves point to themselves
+    feature : 1D integer array
+        index of the feature every node splits on
+    threshold : 1D float32 array
+        the split value; samples with `feature <= threshold` go to the left child
+    value : 1D or 2D float array
+        the prediction of every leaf: the class probabilities for classifiers, the
+        target value for regressors
+    roots : 1D integer array
+        the index of the root node of every tree
+    classes : 1D array, optional (default: None)
+        the class labels; None for regressors
+    """
+
+    def __init__(self, left, right, feature, threshold, value, roots, classes=None):
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+
+    @property
+    def n_nodes(self):
+        return len(self.left)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        """flattens the trees of a fitted scikit-learn forest
+
+        Parameters
+        ----------
+        forest : `RandomForestClassifier` or `RandomForestRegressor`
+            the fitted forest; only single-output models are supported. works with
+            the forests of older scikit-learn versions as well, which lack
+            `n_features_in_`
+
+        Returns
+        -------
+        compact_forest : `CompactForest`
+        """
+        classes = getattr(forest, "classes_", None)
+        if classes is not None:
+            # string labels come as an object array that `np.save` would pickle
+            classes = np.array(classes.tolist())
+
+        left, right, feature, threshold, value, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left < 0
+            own_index = np.arange(offset, offset + tree.node_count)
+
+            left.append(np.where(is_leaf, own_index, tree.children_left + offset))
+            right.append(np.where(is_leaf, own_index, tree.children_right + offset))
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+
+            if classes is None:
+                value.append(tree.value[:, 0, 0])
+            else:
+                # the class counts (or fractions) of the leaves as probabilities
+                counts = tree.value[:, 0, :]
+                value.append(counts / counts.sum(axis=1, keepdims=True))
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        index_type = np.min_scalar_type(offset)
+        return cls(left=np.concatenate(left).astype(index_type),
+                   right=np.concatenate(right).astype(index_type),
+                   feature=np.concatenate(feature).astype(
+                       np.min_scalar_type(forest.estimators_[0].tree_.n_features)),
+                   threshold=float32_floor(np.concatenate(threshold)),
+                   value=np.concatenate(value),
+                   roots=np.array(roots, dtype=index_type), classes=classes)
+
+    def apply(self, X):
+        """index of the leaf every sample ends up in, for every tree
+
+        Parameters
+        ----------
+        X : 2D array
+            the features, one row per sample
+
+        Returns
+        -------
+        leaves : 2D integer array
+            shape `(n_samples, n_trees)`
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        leaves = np.empty((len(X), self.n_trees), dtype=self.left.dtype)
+        _walk_trees(X, self.left, self.right, self.feature, self.threshold,
+                    self.roots, leaves)
+        return leaves
+
+    def _mean_leaf_value(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        value = self.value.reshape(len(self.value), -1)
+        result = np.zeros((len(X), value.shape[1]))
+        _sum_leaf_values(X, self.left, self.right, self.feature, self.threshold,
+                         self.roots, value, result)
+        result /= self.n_trees
+        return result.reshape((len(X),) + self.value.shape[1:])
+
+    def predict_proba(self, X):
+        """mean class probabilities of all trees; same as the scikit-learn method"""
+        if self.classes_ is None:
+            raise AttributeError("predict_proba is only available for classifiers")
+        return self._mean_leaf_value(X)
+
+    def predict(self, X):
+        """the predicted class (classifiers) or the mean of the tree predictions
+        (regressors); same as the scikit-learn method"""
+        prediction = self._mean_leaf_value(X)
+        if self.classes_ is None:
+            return prediction
+        return self.classes_[np.argmax(prediction, axis=1)]
+
+    def save(self, path, compress=True, energy_unit=None):
+        """writes the forest into an `.npz` file at `path`; with `compress`, the arrays
+        are deflated. the unit of the predictions of a regressor can be stored with
+        it as `energy_unit`, cf. `read_energy_unit`"""
+        arrays = dict(left=self.left, right=self.right, feature=self.feature,
+                      threshold=self.threshold, value=self.value, roots=self.roots)
+        if self.classes_ is not None:
+            arrays["classes"] = self.classes_
+        if energy_unit is not None:
+            arrays["energy_unit"] = np.array(u.Unit(energy_unit).to_string())
+        with open(path, "wb") as outfile:
+            if compress:
+                np.savez_compressed(outfile, **arrays)
+            else:
+                np.savez(outfile, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """reads a forest written by `save`"""
+        with np.load(path) as arrays:
+            return cls(left=arrays["left"], right=arrays["right"],
+                       feature=arrays["feature"], threshold=arrays["threshold"],
+                       value=arrays["value"], roots=arrays["roots"],
+                       classes=arrays["classes"] if "classes" in arrays.files
+                       else None)
+
+
+def read_energy_unit(path):
+    """the `energy_unit` stored in the forest file at `path`; None if there is none"""
+    with np.load(path) as arrays:
+        if "energy_unit" not in arrays.files:
+            return None
+        return u.Unit(str(arrays["energy_unit"]))
+
+
+class CompactModel:
+    """the `CompactForest` of every camera type; stands in for the `EventClassifier`
+    or `EnergyRegressor` it was made from in `tino_cta.batch_prediction`
+
+    Parameters
+    ----------
+    model_dict : dictionary
+        the `CompactForest` per `cam_id`
+    energy_unit : astropy.Unit, optional (default: None)
+        the unit of the energies predicted by a regressor
+    """
+
+    def __init__(self, model_dict, energy_unit=None):
+        self.model_dict = model_dict
+        self.energy_unit = energy_unit
+
+    @classmethod
+    def from_model(cls, model):
+        """converts the fitted forests of a ctapipe `EventClassifier` or
+        `EnergyRegressor`"""
+        return cls({cam_id: CompactForest.from_sklearn(forest)
+                    for cam_id, forest in model.model_dict.items()},
+                   getattr(model, "energy_unit", None))
+
+    def save(self, path, compress=True):
+        """writes one file per camera type; `path` needs a "{cam_id}" placeholder,
+        like the one of `EventClassifier.save`; the `energy_unit` is stored in every
+        file"""
+        for cam_id, forest in self.model_dict.items():
+            forest.save(path.format(cam_id=cam_id), compress, self.energy_unit)
+
+    @classmethod
+    def load(cls, path, cam_id_list, energy_unit=None):
+        """reads the forests of the camera types in `cam_id_list` from the files
+        written by `save`; cf. `EventClassifier.load`
+
+        the `energy_unit` is the one stored in the files unless another one is given
+        """
+        model_dict = {cam_id: CompactForest.load(path.format(cam_id=cam_id))
+                      for cam_id in cam_id_list}
+        if energy_unit is None and cam_id_list:
+            energy_unit = read_energy_unit(path.format(cam_id=cam_id_list[0]))
+        return cls(model_dict, energy_unit)
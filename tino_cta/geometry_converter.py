@@ -1,5 +1,8 @@
+import os
+import hashlib
 import logging
-from collections import namedtuple
+import threading
+from collections import namedtuple, OrderedDict
 import numpy as np
 from astropy import units as u
 from numba import jit
@@ -8,16 +11,20 @@ from ctapipe.instrument import CameraGeometry
 
 logger = logging.getLogger(__name__)
 
-RotBuffer = namedtuple("RotBuffer",
-                       "rot_x,rot_y,x_edges,y_edges,new_geom,rot_angle,pix_rotation,"
-                       "x_scale")
+CacheInfo = namedtuple("CacheInfo", "hits,misses,maxsize,currsize")
 
 
 __all__ = [
     "convert_geometry_hex1d_to_rect2d",
-    "convert_geometry_rect2d_back_to_hexe1d"
+    "convert_geometry_rect2d_back_to_hexe1d",
+    "get_transfer_maps"
 ]
 
+# directory where the transfer maps of the hex-to-rect conversion are kept between
+# runs (and shared among processes); set to `None` to not use the on-disk cache
+transfer_map_dir = os.environ.get(
+    "TINO_CTA_CACHE_DIR", os.path.expanduser("~/.cache/tino_cta/transfer_maps"))
+
 
 def unskew_hex_pixel_grid(pix_x, pix_y, cam_angle=0 * u.deg,
                           base_angle=60 * u.deg):
@@ -243,7 +250,6 @@ def reskew_hex_pixel_from_orthogonal_edges(x_edges, y_edges, square_mask):
     return unrot_x, unrot_y
 
 
-@jit
 def get_orthogonal_grid_edges(pix_x, pix_y, scale_aspect=True):
     """calculate the bin edges of the slanted, orthogonal pixel grid to
     resample the pixel signals with np.histogramdd right after.
@@ -252,6 +258,7 @@ def get_orthogonal_grid_edges(pix_x, pix_y, scale_aspect=True):
     ----------
     pix_x, pix_y : 1D numpy arrays
         the list of x and y coordinates of the slanted, orthogonal pixel grid
+        if `scale_aspect` is set, `pix_x` gets rescaled in place
     scale_aspect : boolean (default: True)
         if True, rescales the x-coordinates to create square pixels
         (instead of rectangular ones)
@@ -264,234 +271,358 @@ def get_orthogonal_grid_edges(pix_x, pix_y, scale_aspect=True):
         factor by which the x-coordinates have been scaled
     """
 
-    # finding the size of the square patches
-    d_x = 99 * u.m
-    d_y = 99 * u.m
-    x_base = pix_x[0]
-    y_base = pix_y[0]
-    for x, y in zip(pix_x, pix_y):
-        if abs(y - y_base) < abs(x - x_base):
-            d_x = min(d_x, abs(x - x_base))
-    for x, y in zip(pix_x, pix_y):
-        if abs(y - y_base) > abs(x - x_base):
-            d_y = min(d_y, abs(y - y_base))
+    # finding the size of the square patches: the smallest distance to the first pixel
+    # along the axis the pixels are rather aligned with
+    dist_x = np.abs(pix_x - pix_x[0]).to(u.m).value
+    dist_y = np.abs(pix_y - pix_y[0]).to(u.m).value
+    d_x = np.min(dist_x[dist_y < dist_x], initial=99) * u.m
+    d_y = np.min(dist_y[dist_y > dist_x], initial=99) * u.m
 
     x_scale = 1
     if scale_aspect:
-        x_scale = d_y / d_x
+        x_scale = (d_y / d_x).to(u.dimensionless_unscaled).value
         pix_x *= x_scale
         d_x = d_y
 
     # with the maximal extension of the axes and the size of the pixels,
     # determine the number of bins in each direction
-    NBinsx = np.around(abs(max(pix_x) - min(pix_x)) / d_x) + 2
-    NBinsy = np.around(abs(max(pix_y) - min(pix_y)) / d_y) + 2
-    x_edges = np.linspace(min(pix_x).value, max(pix_x).value, NBinsx)
-    y_edges = np.linspace(min(pix_y).value, max(pix_y).value, NBinsy)
+    NBinsx = int(np.around(abs(np.max(pix_x) - np.min(pix_x)) / d_x) + 2)
+    NBinsy = int(np.around(abs(np.max(pix_y) - np.min(pix_y)) / d_y) + 2)
+    x_edges = np.linspace(np.min(pix_x).value, np.max(pix_x).value, NBinsx)
+    y_edges = np.linspace(np.min(pix_y).value, np.max(pix_y).value, NBinsy)
 
     return x_edges, y_edges, x_scale
 
 
-# add_angle = 180 * u.deg
-rot_buffer = {}
+def get_geometry_hash(geom, add_rot=0):
+    """hash of the content of a camera geometry (and the additional rotation) that
+    identifies its transfer maps independent of `cam_id` or any other key
 
+    Parameters
+    ----------
+    geom : CameraGeometry object
+        geometry object of a hexagonal camera
+    add_rot : int/float (default: 0)
+        parameter to apply an additional rotation of `add_rot` times 60°
+
+    Returns
+    -------
+    geom_hash : string
+        hexadecimal SHA1 digest of the pixel positions and rotation
+
+    Note
+    ----
+    the hashes are stored as a member of `geom` together with the pixel positions they
+    were computed for, since the same camera geometry will show up many times; new
+    pixel positions assigned to `geom` lead to a new hash
+    """
+    memo = getattr(geom, "geometry_hashes", None)
+    if memo is None or memo[0] is not geom.pix_x or memo[1] is not geom.pix_y:
+        memo = geom.geometry_hashes = (geom.pix_x, geom.pix_y, {})
+
+    if add_rot not in memo[2]:
+        sha1 = hashlib.sha1()
+        for coordinate in [geom.pix_x, geom.pix_y]:
+            # round to a micrometre so that float noise does not change the hash
+            sha1.update(np.round(coordinate.to(u.m).value, 6).tobytes())
+        sha1.update(np.round([geom.pix_rotation.to(u.deg).value, add_rot],
+                             6).tobytes())
+        memo[2][add_rot] = sha1.hexdigest()
+    return memo[2][add_rot]
 
-def convert_geometry_1d_to_2d(geom, signal, key=None, add_rot=0):
-    """converts the geometry object of a camera with a hexagonal grid into
-    a square grid by slanting and stretching the 1D arrays of pixel x
-    and y positions and signal intensities are converted to 2D
-    arrays. If the signal array contains a time-dimension it is
-    conserved.
+
+def make_transfer_maps(geom, add_rot=0):
+    """does the actual work of the hex-to-rect conversion of a camera geometry: skews
+    the pixel grid and creates the maps to resample the images on the rectangular grid
 
     Parameters
     ----------
     geom : CameraGeometry object
-        geometry object of hexagonal cameras
-    signal : ndarray
-        1D (no timing) or 2D (with timing) array of the pmt signals
-    key : (default: None)
-        arbitrary key to store the transformed geometry in a buffer
+        geometry object of a hexagonal camera
     add_rot : int/float (default: 0)
-        parameter to apply an additional rotation of @add_rot times 60°
+        parameter to apply an additional rotation of `add_rot` times 60°
 
     Returns
     -------
-    new_geom : CameraGeometry object
-        geometry object of the slanted picture now with a rectangular
-        grid and a 2D grid for the pixel positions contains now a 2D
-        masking array signifying which of the pixels came from the
-        original geometry and which are simply fillers from the
-        rectangular grid square_img : ndarray 2D (no timing) or 3D
-        (with timing) array of the pmt signals
-
+    transfer_maps : dictionary of numpy arrays
+        `rot_x`, `rot_y` (skewed pixel positions in metres), `x_edges`, `y_edges`,
+        `x_scale`, `rot_angle` (in degrees), `square_mask` and `hex_to_rect_map`
     """
 
-    if key in rot_buffer:
+    # extra_rot is the angle to get back to aligned hexagons with flat
+    # tops. Note that the pixel rotation angle brings the camera so that
+    # hexagons have a point at the top, so need to go 30deg back to
+    # make them flat
+    extra_rot = geom.pix_rotation - 30 * u.deg
 
-        # if the conversion with this key was done and stored before,
-        # just read it in
-        (rot_x, rot_y, x_edges, y_edges, new_geom,
-         rot_angle, pix_rotation, x_scale) = rot_buffer[key]
-    else:
+    # total rotation angle:
+    rot_angle = (add_rot * 60 * u.deg) - extra_rot
 
-        # otherwise, we have to do the conversion now first, skew all
-        # the coordinates of the original geometry
-
-        # extra_rot is the angle to get back to aligned hexagons with flat
-        # tops. Note that the pixel rotation angle brings the camera so that
-        # hexagons have a point at the top, so need to go 30deg back to
-        # make them flat
-        extra_rot = geom.pix_rotation - 30 * u.deg
-
-        # total rotation angle:
-        rot_angle = (add_rot * 60 * u.deg) - extra_rot
-        # if geom.cam_id.startswith("NectarCam")\
-        #         or geom.cam_id.startswith("LSTCam"):
-        #     rot_angle += geom.cam_rotation + 90 * u.deg
-
-        logger.debug("geom={}".format(geom))
-        logger.debug("rot={}, extra={}".format(rot_angle, extra_rot))
-
-        rot_x, rot_y = unskew_hex_pixel_grid(geom.pix_x, geom.pix_y,
-                                             cam_angle=rot_angle)
-
-        # with all the coordinate points, we can define the bin edges
-        # of a 2D histogram
-        x_edges, y_edges, x_scale = get_orthogonal_grid_edges(rot_x, rot_y)
-
-        # this histogram will introduce bins that do not correspond to
-        # any pixel from the original geometry. so we create a mask to
-        # remember the true camera pixels by simply throwing all pixel
-        # positions into numpy.histogramdd: proper pixels contain the
-        # value 1, false pixels the value 0.
-        square_mask = np.histogramdd([rot_y, rot_x],
-                                     bins=(y_edges, x_edges))[0].astype(bool)
-
-        # to be consistent with the pixel intensity, instead of saving
-        # only the rotated positions of the true pixels (rot_x and
-        # rot_y), create 2D arrays of all x and y positions (also the
-        # false ones).
-        grid_x, grid_y = np.meshgrid((x_edges[:-1] + x_edges[1:]) / 2.,
-                                     (y_edges[:-1] + y_edges[1:]) / 2.)
-
-        ids = []
-        # instead of blindly enumerating all pixels, let's instead
-        # store a list of all valid -- i.e. picked by the mask -- 2D
-        # indices
-        for i, row in enumerate(square_mask):
-            for j, val in enumerate(row):
-                if val is True:
-                    ids.append((i, j))
-
-        # the area of the pixels (note that this is still a deformed
-        # image)
-        pix_area = np.ones_like(grid_x) \
-            * (x_edges[1] - x_edges[0]) * (y_edges[1] - y_edges[0])
-
-        # creating a new geometry object with the attributes we just determined
-        new_geom = CameraGeometry(
-            cam_id=geom.cam_id + "_rect",
-            pix_id=ids,  # this is a list of all the valid coordinate pairs now
-            pix_x=grid_x * u.m,
-            pix_y=grid_y * u.m,
-            pix_area=pix_area * u.m ** 2,
-            neighbors=geom.neighbors,
-            pix_type='rectangular', apply_derotation=False)
-
-        # storing the pixel mask and camera rotation for later use
-        new_geom.mask = square_mask
-
-        if key is not None:
-            # if a key is given, store the essential objects in a buffer
-            rot_buffer[key] = RotBuffer(rot_x, rot_y, x_edges, y_edges, new_geom,
-                                        rot_angle, geom.pix_rotation, x_scale)
-
-    # resample the signal array to correspond to the square grid --
-    #  for signal arrays containing time slices (ndim > 1) or not
-    #  approach is the same as used for the mask only with the signal
-    #  as bin-weights
-    if signal.ndim > 1:
-        t_dim = signal.shape[1]
-        square_img = np.histogramdd([np.repeat(rot_y, t_dim),
-                                     np.repeat(rot_x, t_dim),
-                                     [a for a in range(t_dim)] * len(rot_x)],
-                                    bins=(y_edges, x_edges, range(t_dim + 1)),
-                                    weights=signal.ravel())[0]
-    else:
-        square_img = np.histogramdd([rot_y, rot_x],
-                                    bins=(y_edges, x_edges),
-                                    weights=signal)[0]
+    logger.debug("geom={}".format(geom))
+    logger.debug("rot={}, extra={}".format(rot_angle, extra_rot))
+
+    rot_x, rot_y = unskew_hex_pixel_grid(geom.pix_x, geom.pix_y,
+                                         cam_angle=rot_angle)
+
+    # with all the coordinate points, we can define the bin edges
+    # of a 2D histogram
+    x_edges, y_edges, x_scale = get_orthogonal_grid_edges(rot_x, rot_y)
+
+    # this histogram will introduce bins that do not correspond to
+    # any pixel from the original geometry. so we create a mask to
+    # remember the true camera pixels by simply throwing all pixel
+    # positions into numpy.histogramdd: proper pixels contain the
+    # value 1, false pixels the value 0.
+    rot_x, rot_y = rot_x.to(u.m).value, rot_y.to(u.m).value
+    square_mask = np.histogramdd([rot_y, rot_x],
+                                 bins=(y_edges, x_edges))[0].astype(bool)
+
+    # create a transfer map by enumerating all pixel positions in a 2D histogram
+    hex_to_rect_map = np.histogramdd([rot_y, rot_x],
+                                     bins=(y_edges, x_edges),
+                                     weights=np.arange(len(rot_x)))[0].astype(int)
+    # bins that do not correspond to the original image get an entry of `-1`
+    hex_to_rect_map[~square_mask] = -1
 
-    return new_geom, square_img
+    return {"rot_x": rot_x, "rot_y": rot_y,
+            "x_edges": x_edges, "y_edges": y_edges,
+            "x_scale": x_scale, "rot_angle": rot_angle.to(u.deg).value,
+            "square_mask": square_mask, "hex_to_rect_map": hex_to_rect_map}
 
 
-unrot_buffer = {}  # todo: should just make this a function with @lru_cache
+def get_transfer_map_path(geom_hash, cam_id=""):
+    return os.path.join(transfer_map_dir, "{}_{}.npz".format(cam_id, geom_hash))
 
 
-def convert_geometry_back(geom, signal, key, add_rot=0):
-    """reverts the geometry distortion performed by
-    convert_geometry_1d_to_2d back to a hexagonal grid stored in 1D
-    arrays
+def read_transfer_maps(path):
+    """reads the transfer maps written by `write_transfer_maps`; returns `None`
+    if there is no (readable) file at `path`"""
+    try:
+        with np.load(path) as maps:
+            return {key: maps[key] for key in maps.files}
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_transfer_maps(path, transfer_maps):
+    """writes `transfer_maps` into an (uncompressed) `.npz` file at `path`
+
+    the file is first written under a temporary name and then moved into place so
+    that concurrent jobs never read a half-written file
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as tmp_file:
+        np.savez(tmp_file, **transfer_maps)
+    os.replace(tmp_path, path)
+
+
+def get_transfer_maps(geom, add_rot=0):
+    """returns the transfer maps of `geom` -- read from the on-disk cache in
+    `transfer_map_dir` if they have been produced before, created (and put into the
+    cache) by `make_transfer_maps` otherwise
 
     Parameters
     ----------
-    geom : CameraGeometry
-        geometry object where pixel positions are stored in a 2D
-        rectangular camera grid
-    signal : ndarray
-        pixel intensity stored in a 2D rectangular camera grid
-    key:
-        key to retrieve buffered geometry information
+    geom : CameraGeometry object
+        geometry object of a hexagonal camera
     add_rot : int/float (default: 0)
-        parameter to apply an additional rotation of @add_rot times 60°
+        parameter to apply an additional rotation of `add_rot` times 60°
 
     Returns
     -------
-    unrot_geom : CameraGeometry
-        pixel rotated back to a hexagonal grid stored in a 1D array
-    signal : ndarray
-        1D (no timing) or 2D (with timing) array of the pmt signals
+    transfer_maps : dictionary of numpy arrays
+        cf. `make_transfer_maps`
+    """
+    if transfer_map_dir is None:
+        return make_transfer_maps(geom, add_rot)
+
+    path = get_transfer_map_path(get_geometry_hash(geom, add_rot), geom.cam_id)
+    transfer_maps = read_transfer_maps(path)
+    if transfer_maps is None:
+        transfer_maps = make_transfer_maps(geom, add_rot)
+        try:
+            write_transfer_maps(path, transfer_maps)
+        except OSError as e:
+            logger.warning("could not write transfer maps to {}: {}".format(path, e))
+    return transfer_maps
+
+
+# add_angle = 180 * u.deg
+class GeometryCache:
+    """bounded, thread-safe buffer of the converted camera geometries
+
+    behaves like a dictionary but holds at most `maxsize` entries; if another one is
+    added, the one that was least recently used is dropped. like `functools.lru_cache`,
+    it counts the hits and misses of the look-ups
 
+    Parameters
+    ----------
+    maxsize : integer (default: 32)
+        maximum number of entries kept in the cache
     """
-    global unrot_buffer
 
-    square_mask = geom.mask
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per key whose entry is being created by `get_or_create`
+        self._key_locks = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        """returns the entry for `key`; if there is none, it is created by calling
+        `factory()` and stored -- only once, even if several threads ask for it
+
+        `factory()` only holds the lock of `key`, so look-ups of other keys are not
+        blocked while it runs"""
+        value = self.get(key, self)
+        if value is not self:
+            return value
+
+        with self._lock:
+            # re-entrant, so that `factory` may use the cache as well
+            key_lock = self._key_locks.setdefault(key, threading.RLock())
+        with key_lock:
+            # another thread might have created the entry in the meantime
+            with self._lock:
+                value = self._entries.get(key, self)
+            if value is self:
+                value = factory()
+                self[key] = value
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+
+# buffer of the rectangular geometries and transfer maps of the hexagonal cameras
+rot_buffer = GeometryCache()
+
+
+def make_rect_geometry(geom, add_rot=0):
+    """creates the geometry of the rectangular grid of a hexagonal camera and the
+    transfer maps to resample its images onto it and back
 
-    if key in unrot_buffer:
-        unrot_geom = unrot_buffer[key]
-    else:
-        if key in rot_buffer:
-            x_scale = rot_buffer[key].x_scale
-            rot_angle = rot_buffer[key].rot_angle
-            pix_rotation = rot_buffer[key].pix_rotation
-        else:
-            raise KeyError("key '{}' not found in the buffer".format(key))
-
-        grid_x, grid_y = geom.pix_x / x_scale, geom.pix_y
-
-        unrot_x, unrot_y = reskew_hex_pixel_grid(grid_x[square_mask],
-                                                 grid_y[square_mask],
-                                                 rot_angle)
-
-        # TODO: probably should use base constructor, not guess here:
-        # unrot_geom = CameraGeometry.guess(unrot_x, unrot_y, foc_len,
-        #                                  apply_derotation=False)
-        unrot_geom = CameraGeometry(cam_id=geom.cam_id + "_hex",
-                                    pix_id=np.arange(len(unrot_x)),
-                                    pix_x=unrot_x,
-                                    pix_y=unrot_y,
-                                    pix_area=None,  # recalc
-                                    pix_type='hexagonal',
-                                    pix_rotation=pix_rotation,
-                                    # apply_derotation=False
-                                    )
-
-        unrot_buffer[key] = unrot_geom
-
-    return unrot_geom, signal[square_mask, ...]
-
-
-def convert_geometry_hex1d_to_rect2d(geom, signal, key=None, add_rot=0):
+    Parameters
+    ----------
+    geom : CameraGeometry object
+        geometry object of a hexagonal camera
+    add_rot : int/float (default: 0)
+        parameter to apply an additional rotation of `add_rot` times 60°
+
+    Returns
+    -------
+    new_geom : CameraGeometry object
+        the rectangular geometry
+    hex_to_rect_map : 2D ndarray
+        the index of the hexagonal pixel in every rectangular one (-1 for fake pixels)
+    rect_to_hex_map : 1D ndarray
+        the index of the rectangular pixel (in the flattened image) of every
+        hexagonal one
+    """
+
+    # do the conversion first now -- or at least read the
+    # transfer maps from the on-disk cache
+    transfer_maps = get_transfer_maps(geom, add_rot)
+    x_edges = transfer_maps["x_edges"]
+    y_edges = transfer_maps["y_edges"]
+    square_mask = transfer_maps["square_mask"]
+    hex_to_rect_map = transfer_maps["hex_to_rect_map"]
+
+    # to be consistent with the pixel intensity, instead of saving
+    # only the rotated positions of the true pixels (rot_x and
+    # rot_y), create 2D arrays of all x and y positions (also the
+    # false ones).
+    grid_x, grid_y = np.meshgrid((x_edges[:-1] + x_edges[1:]) / 2.,
+                                 (y_edges[:-1] + y_edges[1:]) / 2.)
+
+    ids = []
+    # instead of blindly enumerating all pixels, let's instead
+    # store a list of all valid -- i.e. picked by the mask -- 2D
+    # indices
+    for i, row in enumerate(square_mask):
+        for j, val in enumerate(row):
+            if val is True:
+                ids.append((i, j))
+
+    # the area of the pixels (note that this is still a deformed
+    # image)
+    pix_area = np.ones_like(grid_x) \
+        * (x_edges[1] - x_edges[0]) * (y_edges[1] - y_edges[0])
+
+    # creating a new geometry object with the attributes we just determined
+    new_geom = CameraGeometry(
+        cam_id=geom.cam_id + "_rect",
+        pix_id=ids,  # this is a list of all the valid coordinate pairs now
+        pix_x=grid_x * u.m,
+        pix_y=grid_y * u.m,
+        pix_area=pix_area * u.m ** 2,
+        neighbors=geom.neighbors,
+        pix_type='rectangular', apply_derotation=False)
+
+    # storing the pixel mask for later use
+    new_geom.mask = square_mask
+
+    # and what is needed to find the way back to the hexagonal geometry
+    new_geom.hex_geom = geom
+    new_geom.add_rot = add_rot
+
+    # the inverse map: where to find every hexagonal pixel in the flat rectangular image
+    rect_to_hex_map = np.empty(np.count_nonzero(square_mask), dtype=int)
+    rect_to_hex_map[hex_to_rect_map[square_mask]] = np.flatnonzero(square_mask)
+
+    return new_geom, hex_to_rect_map, rect_to_hex_map
+
+
+def get_rect_geometry(geom, add_rot=0):
+    """buffered version of `make_rect_geometry`; the entries in `rot_buffer` are
+    keyed by the content of `geom` (cf. `get_geometry_hash`), so that different
+    geometries can never share an entry"""
+    return rot_buffer.get_or_create(get_geometry_hash(geom, add_rot),
+                                    lambda: make_rect_geometry(geom, add_rot))
+
+
+def convert_geometry_hex1d_to_rect2d(geom, signal, key=None, add_rot=0, out=None):
     """converts the geometry object of a camera with a hexagonal grid into
     a square grid by slanting and stretching the 1D arrays of pixel x
     and y positions and signal intensities are converted to 2D
@@ -503,11 +634,16 @@ def convert_geometry_hex1d_to_rect2d(geom, signal, key=None, add_rot=0):
     geom : CameraGeometry object
         geometry object of hexagonal cameras
     signal : ndarray
-        1D (no timing) or 2D (with timing) array of the pmt signals
+        1D (no timing) or 2D (with timing) array of the pmt signals,
+        i.e. shape `(n_pix,)` or `(n_pix, n_samples)`
     key : (default: None)
-        arbitrary key to store the transformed geometry in a buffer
+        not used -- only here for backwards compatibility; the converted geometries
+        are buffered by the content of `geom` (cf. `get_rect_geometry`)
     add_rot : int/float (default: 0)
         parameter to apply an additional rotation of `add_rot` times 60°
+    out : float ndarray, optional (default: None)
+        array of shape `(ny, nx)` or `(ny, nx, n_samples)` to write the rectangular
+        image into -- e.g. to reuse it for every event; a new one is created if None
 
     Returns
     -------
@@ -521,124 +657,24 @@ def convert_geometry_hex1d_to_rect2d(geom, signal, key=None, add_rot=0):
         the rectangular signal image
     """
 
-    if key in rot_buffer:
+    new_geom, hex_to_rect_map, _ = get_rect_geometry(geom, add_rot)
 
-        # if the conversion with this key was done before and stored,
-        # just read it in
-        (geom, new_geom, hex_to_rect_map) = rot_buffer[key]
-    else:
+    signal = np.asarray(signal, dtype=float)
+    if out is None:
+        out = np.empty(hex_to_rect_map.shape + signal.shape[1:])
 
-        # otherwise, we have to do the conversion first now,
-        # skew all the coordinates of the original geometry
-
-        # extra_rot is the angle to get back to aligned hexagons with flat
-        # tops. Note that the pixel rotation angle brings the camera so that
-        # hexagons have a point at the top, so need to go 30deg back to
-        # make them flat
-        extra_rot = geom.pix_rotation - 30 * u.deg
-
-        # total rotation angle:
-        rot_angle = (add_rot * 60 * u.deg) - extra_rot
-
-        logger.debug("geom={}".format(geom))
-        logger.debug("rot={}, extra={}".format(rot_angle, extra_rot))
-
-        rot_x, rot_y = unskew_hex_pixel_grid(geom.pix_x, geom.pix_y,
-                                             cam_angle=rot_angle)
-
-        # with all the coordinate points, we can define the bin edges
-        # of a 2D histogram
-        x_edges, y_edges, x_scale = get_orthogonal_grid_edges(rot_x, rot_y)
-
-        # this histogram will introduce bins that do not correspond to
-        # any pixel from the original geometry. so we create a mask to
-        # remember the true camera pixels by simply throwing all pixel
-        # positions into numpy.histogramdd: proper pixels contain the
-        # value 1, false pixels the value 0.
-        square_mask = np.histogramdd([rot_y, rot_x],
-                                     bins=(y_edges, x_edges))[0].astype(bool)
-
-        # to be consistent with the pixel intensity, instead of saving
-        # only the rotated positions of the true pixels (rot_x and
-        # rot_y), create 2D arrays of all x and y positions (also the
-        # false ones).
-        grid_x, grid_y = np.meshgrid((x_edges[:-1] + x_edges[1:]) / 2.,
-                                     (y_edges[:-1] + y_edges[1:]) / 2.)
-
-        ids = []
-        # instead of blindly enumerating all pixels, let's instead
-        # store a list of all valid -- i.e. picked by the mask -- 2D
-        # indices
-        for i, row in enumerate(square_mask):
-            for j, val in enumerate(row):
-                if val is True:
-                    ids.append((i, j))
-
-        # the area of the pixels (note that this is still a deformed
-        # image)
-        pix_area = np.ones_like(grid_x) \
-            * (x_edges[1] - x_edges[0]) * (y_edges[1] - y_edges[0])
-
-        # creating a new geometry object with the attributes we just determined
-        new_geom = CameraGeometry(
-            cam_id=geom.cam_id + "_rect",
-            pix_id=ids,  # this is a list of all the valid coordinate pairs now
-            pix_x=grid_x * u.m,
-            pix_y=grid_y * u.m,
-            pix_area=pix_area * u.m ** 2,
-            neighbors=geom.neighbors,
-            pix_type='rectangular', apply_derotation=False)
-
-        # storing the pixel mask for later use
-        new_geom.mask = square_mask
-
-        # create a transfer map by enumerating all pixel positions in a 2D histogram
-        hex_to_rect_map = np.histogramdd([rot_y, rot_x],
-                                         bins=(y_edges, x_edges),
-                                         weights=np.arange(len(signal)))[0].astype(int)
-        # bins that do not correspond to the original image get an entry of `-1`
-        hex_to_rect_map[~square_mask] = -1
-
-        if signal.ndim > 1:
-            long_map = []
-            for i in range(signal.shape[-1]):
-                tmp_map = hex_to_rect_map + i * (np.max(hex_to_rect_map) + 1)
-                tmp_map[~square_mask] = -1
-                long_map.append(tmp_map)
-            hex_to_rect_map = np.array(long_map)
-
-        if key is not None:
-            # if a key is given, store the essential objects in a buffer
-            rot_buffer[key] = (geom, new_geom, hex_to_rect_map)
-
-    # done `if key in rot_buffer`
-
-    # create the rotated rectangular image by applying `hex_to_rect_map` to the flat,
-    # extended input image
-    # `input_img_ext` is the flattened input image extended by one entry that contains NaN
-    # since `hex_to_rect_map` contains `-1` for "fake" pixels, it maps this extra NaN
-    # value at the last array position to any bin that does not correspond to a pixel of
-    # the original image
-    input_img_ext = np.full(np.prod(signal.shape) + 1, np.nan)
-
-    # the way the map is produced, it has the time dimension as axis=0;
-    # but `signal` has it as axis=-1, so we need to roll the axes back and forth a bit.
-    # if there is no time dimension, `signal` is a 1d array and `rollaxis` has no effect.
-    input_img_ext[:-1] = np.rollaxis(signal, axis=-1, start=0).ravel()
-
-    # now apply the transfer map
-    rot_img = input_img_ext[hex_to_rect_map]
-
-    # if there is a time dimension, roll the time axis back to the last position
-    try:
-        rot_img = np.rollaxis(rot_img, 0, 3)
-    except ValueError:
-        pass
+    # create the rotated rectangular image by picking the pixels listed in
+    # `hex_to_rect_map` -- along the first axis, so that a time dimension is carried
+    # along for free; the `-1` of the "fake" pixels get clipped to a valid index,
+    # these bins are then set to NaN
+    np.take(signal, hex_to_rect_map, axis=0, out=out, mode="clip")
+    out[~new_geom.mask] = np.nan
 
-    return new_geom, rot_img
+    return new_geom, out
 
 
-def convert_geometry_rect2d_back_to_hexe1d(geom, signal, key=None, add_rot=None):
+def convert_geometry_rect2d_back_to_hexe1d(geom, signal, key=None, add_rot=None,
+                                           out=None):
     """reverts the geometry distortion performed by convert_geometry_hexe1d_to_rect_2d
     back to a hexagonal grid stored in 1D arrays
 
@@ -648,11 +684,15 @@ def convert_geometry_rect2d_back_to_hexe1d(geom, signal, key=None, add_rot=None)
         geometry object where pixel positions are stored in a 2D
         rectangular camera grid
     signal : ndarray
-        pixel intensity stored in a 2D rectangular camera grid
+        pixel intensity stored in a 2D rectangular camera grid,
+        i.e. shape `(ny, nx)` or `(ny, nx, n_samples)`
     key:
-        key to retrieve buffered geometry information
+        not used -- only here for backwards compatibility
     add_rot:
         not used -- only here for backwards compatibility
+    out : float ndarray, optional (default: None)
+        array of shape `(n_pix,)` or `(n_pix, n_samples)` to write the hexagonal
+        image into; a new one is created if None
 
     Returns
     -------
@@ -662,43 +702,24 @@ def convert_geometry_rect2d_back_to_hexe1d(geom, signal, key=None, add_rot=None)
         1D (no timing) or 2D (with timing) array of the pmt signals
     """
 
-    if key in rot_buffer:
-        (old_geom, new_geom, hex_square_map) = rot_buffer[key]
-    else:
-        raise KeyError("key '{}' not found in the buffer".format(key)
+    try:
+        old_geom = geom.hex_geom
+    except AttributeError:
+        raise KeyError("geometry '{}' was not created by ".format(geom.cam_id)
+                       + "convert_geometry_hex1d_to_rect2d"
                        + " -- don't know how to undo rotation")
 
-    # the output image has as many entries as there are non-negative values in the
-    # transfer map (this accounts for time as well)
-    unrot_img = np.zeros(np.count_nonzero(hex_square_map >= 0))
-
-    # rearrange input `signal` according to the mask and map
-    # (the dots in the brackets expand the mask to account for a possible time dimension)
-    # `atleast_3d` ensures that there is a third axis that we can roll to the front
-    # even if there is no time; if we'd use `axis=-1` instead, in cas of no time
-    # dimensions, we would rotate the x and y axes, resulting in a mirrored image
-    # `squeeze` reduces the added axis again in the no-time-slices cases
-    unrot_img[hex_square_map[..., new_geom.mask]] = \
-        np.squeeze(np.rollaxis(np.atleast_3d(signal), 2, 0))[..., new_geom.mask]
-
-    # if `signal` has a third dimension, that is the time
-    # and we need to roll some axes again...
-    if signal.ndim == 3:
-
-        # unrot_img[hex_square_map[..., new_geom.mask]] = \
-            # np.rollaxis(signal, -1, 0)[..., new_geom.mask]
-
-        # reshape the image so that the time is the first axis
-        # and then roll the time to the back
-        unrot_img = unrot_img.reshape((signal.shape[2],
-                                       np.count_nonzero(new_geom.mask)))
-        unrot_img = np.rollaxis(unrot_img, -1, 0)
-    # else:
-    #     unrot_img[hex_square_map[new_geom.mask]] = \
-    #         signal[new_geom.mask]
-
-
-    return old_geom, unrot_img
+    _, _, rect_to_hex_map = get_rect_geometry(old_geom, geom.add_rot)
+
+    # flatten the two spatial axes (a view as long as `signal` is contiguous) and pick
+    # every hexagonal pixel from there; a time dimension is carried along
+    signal = np.asarray(signal, dtype=float)
+    flat_signal = signal.reshape((-1,) + signal.shape[2:])
+    if out is None:
+        out = np.empty((len(rect_to_hex_map),) + signal.shape[2:])
+    np.take(flat_signal, rect_to_hex_map, axis=0, out=out, mode="clip")
+
+    return old_geom, out
 
 
 convert_geometry_1d_to_2d = convert_geometry_hex1d_to_rect2d
@@ -0,0 +1,134 @@
+"""fits the per-camera models of an `EventClassifier` or `EnergyRegressor` concurrently
+
+ctapipe's `fit` trains the random forests of the different camera types one after the
+other, each with a single thread by default. Here, every camera type is fitted in its
+own forked worker process, and every forest can use several threads for its trees on
+top of that. The workers report the wall time and the peak memory of their fit.
+"""
+
+import time
+import resource
+import multiprocessing
+from collections import namedtuple
+
+
+__all__ = ["fit_per_camera", "print_training_report"]
+
+
+TrainingReport = namedtuple("TrainingReport", "cam_id,n_images,wall_time,max_rss")
+
+
+# set in the forked workers by `_init_worker`
+_worker_args = None
+
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+
+def _fit_camera(cam_id):
+    """fits the model of `cam_id` in a worker; cf. `_fit_one`"""
+    return _fit_one(*_worker_args, cam_id)
+
+
+def _fit_one(model, X, y, sample_weight, cam_id):
+    """fits the model of `cam_id`; returns the fitted scikit-learn model together with
+    the `TrainingReport` of the fit"""
+    start = time.time()
+    if sample_weight is None:
+        model.fit({cam_id: X[cam_id]}, {cam_id: y[cam_id]})
+    else:
+        model.fit({cam_id: X[cam_id]}, {cam_id: y[cam_id]},
+                  {cam_id: sample_weight[cam_id]})
+    wall_time = time.time() - start
+
+    # `ru_maxrss` is given in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return model.model_dict[cam_id], TrainingReport(cam_id, len(X[cam_id]),
+                                                     wall_time, max_rss)
+
+
+def fit_per_camera(model, X, y, sample_weight=None, n_jobs=None, n_threads=None):
+    """same as `model.fit(X, y, sample_weight)` but fits the models of the different
+    camera types in parallel
+
+    Parameters
+    ----------
+    model : `EventClassifier` or `EnergyRegressor`
+        the ctapipe wrapper of the per-camera models; the fitted scikit-learn models
+        are put into its `model_dict`
+    X, y, sample_weight : dictionaries
+        the features, targets and (optionally) sample weights per `cam_id`; cf.
+        `model.fit`
+    n_jobs : integer, optional (default: None)
+        number of camera types fitted at the same time; all of them if None. with
+        only one at a time, the models are fitted in this process
+    n_threads : integer, optional (default: None)
+        number of threads every forest builds its trees with; if None, the `n_jobs`
+        the models have been created with is used
+
+    Returns
+    -------
+    reports : list of `TrainingReport`
+        camera type, number of images, wall time (in seconds) and peak resident
+        memory (in bytes) of the worker process of every fit
+
+    Raises
+    ------
+    KeyError
+        if `model` has no model for one of the camera types in `X`, like `model.fit`
+
+    Note
+    ----
+    The workers are forked from the current process, so the training data is not
+    copied; the fitted models are sent back, though. The peak memory of a worker
+    includes what it shares with the parent process at the time of the fork. Without
+    workers, the peak memory is the one of this process up to the end of every fit.
+    """
+    for cam_id in X:
+        if cam_id not in model.model_dict:
+            raise KeyError("no model for camera type {}".format(cam_id))
+    cam_ids = list(X)
+    n_jobs = min(n_jobs or len(cam_ids), len(cam_ids))
+
+    old_n_threads = {}
+    if n_threads is not None:
+        for cam_id in cam_ids:
+            old_n_threads[cam_id] = model.model_dict[cam_id].get_params()["n_jobs"]
+            model.model_dict[cam_id].set_params(n_jobs=n_threads)
+
+    if n_jobs <= 1:
+        # one camera type after the other; no need to send the models around
+        results = [_fit_one(model, X, y, sample_weight, cam_id) for cam_id in cam_ids]
+    else:
+        # one fresh process per camera type, so that the peak memory of every worker
+        # only belongs to one fit
+        pool = multiprocessing.get_context("fork").Pool(
+            n_jobs, initializer=_init_worker, initargs=(model, X, y, sample_weight),
+            maxtasksperchild=1)
+        try:
+            results = pool.map(_fit_camera, cam_ids, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    reports = []
+    for cam_id, (fitted_model, report) in zip(cam_ids, results):
+        # don't keep the training threads for the predictions
+        if cam_id in old_n_threads:
+            fitted_model.set_params(n_jobs=old_n_threads[cam_id])
+            model.model_dict[cam_id].set_params(n_jobs=old_n_threads[cam_id])
+        model.model_dict[cam_id] = fitted_model
+        reports.append(report)
+
+    return reports
+
+
+def print_training_report(reports):
+    """prints the wall time and peak memory of every fit in `reports`"""
+    print("{:>10} {:>10} {:>10} {:>12}".format(
+        "cam_id", "images", "time / s", "memory / MB"))
+    for report in reports:
+        print("{:>10} {:>10} {:>10.1f} {:>12.0f}".format(
+            report.cam_id, report.n_images, report.wall_time, report.max_rss / 2**20))
@@ -1,7 +1,10 @@
 import numpy as np
 from astropy import units as u
 
+import copy
+import signal
 import warnings
+import multiprocessing
 
 from collections import namedtuple, OrderedDict
 
@@ -11,7 +14,7 @@ from ctapipe.image import hillas
 
 from ctapipe.utils.linalg import rotation_matrix_2d
 
-from tino_cta.ImageCleaning import ImageCleaner, EdgeEvent
+from tino_cta.ImageCleaning import ImageCleaner
 from ctapipe.utils.CutFlow import CutFlow
 from ctapipe.coordinates.coordinate_transformations import (
             az_to_phi, alt_to_theta, transform_pixel_position)
@@ -31,21 +34,208 @@ def stub(event):
                          err_est_pos=None, err_est_dir=None)
 
 
-tel_phi = {}
-tel_theta = {}
-tel_orientation = (tel_phi, tel_theta)
-
-# use this in the selection of the gain channels
-np_true_false = np.array([[True], [False]])
-
-
 def raise_error(message):
     raise ValueError(message)
 
 
+def pick_gain_channel_batch(pmt_signals, pe_thresh, out=None):
+    """selects one gain channel for every pixel of a whole stack of images of the same
+    camera type -- e.g. of all telescopes of that type in one event or of many events
+
+    Parameters
+    ----------
+    pmt_signals : 3D array
+        the images with shape `(n_images, n_channels, n_pix)`
+    pe_thresh : float
+        pixels with a signal above `pe_thresh` in any channel take the second (low
+        gain) channel, all others the first (high gain) one; ignored for single-channel
+        images
+    out : 2D array, optional (default: None)
+        array of shape `(n_images, n_pix)` to write the selected signals into; a new
+        one is created if None
+
+    Returns
+    -------
+    out : 2D array
+        the selected signal of every pixel of every image
+    """
+    pmt_signals = np.asarray(pmt_signals)
+    if out is None:
+        out = np.empty((pmt_signals.shape[0], pmt_signals.shape[-1]),
+                       dtype=pmt_signals.dtype)
+
+    out[:] = pmt_signals[:, 0]
+    if pmt_signals.shape[1] > 1:
+        np.copyto(out, pmt_signals[:, 1],
+                  where=(pmt_signals > pe_thresh).any(axis=1))
+    return out
+
+
+class SubarrayPointing:
+    """pointing and camera geometry of every telescope of a subarray, in arrays
+    indexed by `tel_id`
+
+    The pixel positions of the cameras are corrected with `transform_pixel_position`
+    once, on copies of the camera geometries -- the instrument description of the
+    events is not modified. The pointing of a telescope is taken from the MC
+    information of the first event it takes part in.
+
+    Parameters
+    ----------
+    subarray : ctapipe SubarrayDescription
+        the telescopes to prepare the camera geometries of
+
+    Attributes
+    ----------
+    cameras : 1D object array
+        the camera geometry with the corrected pixel positions
+    tel_types : 1D object array
+        the size class of the telescope ("LST", "MST" or "SST")
+    phi, theta : 1D `astropy.Quantity` arrays
+        azimuth and zenith angle of the pointing; NaN for the telescopes that have not
+        taken part in an event yet
+    """
+
+    def __init__(self, subarray):
+        self.cameras = np.empty(0, dtype=object)
+        self.tel_types = np.empty(0, dtype=object)
+        self._phi = np.empty(0)
+        self._theta = np.empty(0)
+
+        # the corrected copy of every distinct camera geometry object, so that the
+        # telescopes sharing a geometry keep sharing it
+        self._corrected = {}
+
+        self.add_telescopes(subarray, list(subarray.tel))
+
+    @property
+    def phi(self):
+        return u.Quantity(self._phi, u.rad, copy=False)
+
+    @property
+    def theta(self):
+        return u.Quantity(self._theta, u.rad, copy=False)
+
+    def _grow(self, n_tels):
+        n_new = n_tels - len(self.cameras)
+        if n_new <= 0:
+            return
+        self.cameras = np.concatenate([self.cameras, np.empty(n_new, dtype=object)])
+        self.tel_types = np.concatenate([self.tel_types,
+                                         np.empty(n_new, dtype=object)])
+        self._phi = np.concatenate([self._phi, np.full(n_new, np.nan)])
+        self._theta = np.concatenate([self._theta, np.full(n_new, np.nan)])
+
+    def correct_camera(self, camera):
+        """copy of `camera` with the pixel positions corrected"""
+        key = id(camera)
+        if key not in self._corrected:
+            corrected = copy.copy(camera)
+            corrected.pix_x, corrected.pix_y = \
+                transform_pixel_position(camera.pix_x, camera.pix_y)
+            # keep `camera` alive so that its `id` isn't taken by another object
+            self._corrected[key] = (camera, corrected)
+        return self._corrected[key][1]
+
+    def add_telescopes(self, subarray, tel_ids):
+        """adds the camera geometries and size classes of the telescopes `tel_ids` of
+        `subarray`"""
+        if len(tel_ids) == 0:
+            return
+        self._grow(max(tel_ids) + 1)
+        for tel_id in tel_ids:
+            tel = subarray.tel[tel_id]
+            self.cameras[tel_id] = self.correct_camera(tel.camera)
+            self.tel_types[tel_id] = tel.optics.tel_type
+
+    def update(self, event):
+        """fills in the pointing of the telescopes of `event` that take part in an
+        event for the first time
+
+        Returns
+        -------
+        tel_ids : 1D integer array
+            the IDs of the telescopes with data in `event`
+        """
+        tel_ids = np.array(list(event.dl0.tels_with_data), dtype=int)
+        if len(tel_ids) == 0:
+            return tel_ids
+
+        self._grow(tel_ids.max() + 1)
+        new_ids = tel_ids[np.isnan(self._phi[tel_ids])]
+        if len(new_ids):
+            self.add_telescopes(event.inst.subarray,
+                                [tel_id for tel_id in new_ids
+                                 if self.cameras[tel_id] is None])
+            azimuth = u.Quantity([event.mc.tel[tel_id].azimuth_raw
+                                  for tel_id in new_ids], u.rad)
+            altitude = u.Quantity([event.mc.tel[tel_id].altitude_raw
+                                   for tel_id in new_ids], u.rad)
+            self._phi[new_ids] = az_to_phi(azimuth).to(u.rad).value
+            self._theta[new_ids] = alt_to_theta(altitude).to(u.rad).value
+        return tel_ids
+
+
+def get_cutflow_counts(cutflows):
+    """returns a snapshot of the counters of all given `CutFlow` objects as a list
+    of `OrderedDict` mapping the names of the cuts to their current count
+    """
+    return [OrderedDict((cut, entry[1]) for cut, entry in cutflow.cuts.items())
+            for cutflow in cutflows]
+
+
+def merge_cutflow_counts(cutflows, counts):
+    """adds the `counts` (as produced by `get_cutflow_counts`) to the counters of
+    the corresponding `CutFlow` in `cutflows`; cuts unknown to a `CutFlow` are added
+    as pure counting stages
+    """
+    for cutflow, cut_counts in zip(cutflows, counts):
+        for cut, count in cut_counts.items():
+            cutflow.count(cut, weight=count)
+
+
+# the `EventPreparer` of a worker process, set by `_init_worker`
+_worker_preper = None
+
+
+def _init_worker(preper):
+    global _worker_preper
+    _worker_preper = preper
+    # Ctrl+C reaches the whole process group; only the parent process handles it --
+    # it terminates the pool. a handler inherited from the parent would run its exit
+    # hooks with the forked copies of the parent's output buffers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the worker processes every event it gets serially
+    _worker_preper.n_jobs = 1
+
+
+def _prepare_in_worker(task):
+    """runs `EventPreparer.prepare_event` on a single event in a worker process
+
+    Returns
+    -------
+    prepared : list of `PreparedEvent`
+        the (zero or more) prepared events yielded for this event
+    counts_diff : list of `OrderedDict`
+        how much each cutflow counter of the worker advanced for this event
+    """
+    event, return_stub = task
+
+    cutflows = _worker_preper.get_cutflows()
+    counts_before = get_cutflow_counts(cutflows)
+    prepared = list(_worker_preper.prepare_event([event], return_stub))
+    counts_after = get_cutflow_counts(cutflows)
+
+    counts_diff = [OrderedDict((cut, count - before.get(cut, 0))
+                               for cut, count in after.items())
+                   for before, after in zip(counts_before, counts_after)]
+
+    return prepared, counts_diff
+
+
 class EventPreparer():
 
-    # for gain channel selection
+    # default thresholds for the gain channel selection; cf. `pe_thresh` in `__init__`
     pe_thresh = {
         "ASTRICam": 14,
         "LSTCam": 100,
@@ -54,13 +244,36 @@ class EventPreparer():
     def __init__(self, calib=None, cleaner=None, hillas_parameters=None,
                  shower_reco=None, event_cutflow=None, image_cutflow=None,
                  # event/image cuts:
-                 allowed_cam_ids=None, min_ntel=1, min_charge=0, min_pixel=2):
+                 allowed_cam_ids=None, min_ntel=1, min_charge=0, min_pixel=2,
+                 # parallel processing:
+                 n_jobs=1, ordered=True, chunksize=1,
+                 # gain channel selection:
+                 pe_thresh=None,
+                 # telescope pointing and camera geometries:
+                 pointing=None):
         self.calib = calib or CameraCalibrator(None, None)
         self.cleaner = cleaner or ImageCleaner(mode=None)
         self.hillas_parameters = hillas_parameters or hillas.hillas_parameters
         self.shower_reco = shower_reco or \
             raise_error("need to provide a shower reconstructor....")
 
+        # number of worker processes; only if larger than 1, events are distributed
+        # among a pool of processes -- `ordered` decides whether the prepared events
+        # are yielded in the order of `source` or as soon as they are ready
+        self.n_jobs = n_jobs
+        self.ordered = ordered
+        self.chunksize = chunksize
+
+        # thresholds of the gain channel selection per `cam_id`; the given ones are
+        # added to (or replace) the defaults of the class
+        self.pe_thresh = dict(EventPreparer.pe_thresh, **(pe_thresh or {}))
+        # the selected images of every camera type are written into these arrays
+        self.gain_buffers = {}
+
+        # the `SubarrayPointing` passed to the shower reconstructor; made from the
+        # subarray of the first event if None
+        self.pointing = pointing
+
         # adding cutflows and cuts for events and images
         self.event_cutflow = event_cutflow or CutFlow("EventCutFlow")
         self.image_cutflow = image_cutflow or CutFlow("ImageCutFlow")
@@ -81,23 +294,103 @@ class EventPreparer():
                 ]))
 
     @classmethod
-    def pick_gain_channel(cls, pmt_signal, cam_id):
+    def pick_gain_channel(cls, pmt_signal, cam_id, pe_thresh=None):
         '''the PMTs on some (most?) cameras have 2 gain channels. select one
         according to a threshold. ultimately, this will be done IN the
         camera/telescope itself but until then, do it here
+
+        `pe_thresh` is the table of thresholds per `cam_id`; the defaults of the class
+        if None. cf. `pick_gain_channel_batch`
         '''
 
         if pmt_signal.shape[0] > 1:
-            pmt_signal = np.squeeze(pmt_signal)
-            pick = (cls.pe_thresh[cam_id]
-                    < pmt_signal).any(axis=0) != np_true_false
-            pmt_signal = pmt_signal.T[pick.T]
+            pe_thresh = (pe_thresh or cls.pe_thresh)[cam_id]
+            pmt_signal = pick_gain_channel_batch(pmt_signal[np.newaxis], pe_thresh)[0]
         else:
             pmt_signal = np.squeeze(pmt_signal)
         return pmt_signal
 
+    def pick_gain_channels(self, pmt_signals, cam_id):
+        '''selects the gain channel of a stack of images of camera type `cam_id` with
+        the thresholds of this instance; the result is written into a buffer that is
+        reused for the next stack of the same camera type
+
+        Parameters
+        ----------
+        pmt_signals : 3D array
+            the images with shape `(n_images, n_channels, n_pix)`
+        cam_id : string
+            the camera type of all images
+
+        Returns
+        -------
+        pmt_signals : 2D array
+            the selected signal of every pixel of every image
+        '''
+        pmt_signals = np.asarray(pmt_signals)
+        n_images, n_channels, n_pix = pmt_signals.shape
+
+        buffer = self.gain_buffers.get(cam_id)
+        if buffer is None or len(buffer) < n_images or buffer.shape[1] != n_pix or \
+           buffer.dtype != pmt_signals.dtype:
+            buffer = np.empty((n_images, n_pix), dtype=pmt_signals.dtype)
+            self.gain_buffers[cam_id] = buffer
+
+        pe_thresh = self.pe_thresh[cam_id] if n_channels > 1 else None
+        return pick_gain_channel_batch(pmt_signals, pe_thresh, out=buffer[:n_images])
+
+    def get_cutflows(self):
+        """returns the list of distinct `CutFlow` objects the preparer (and its
+        cleaner) count into"""
+        cutflows = []
+        for cutflow in [self.event_cutflow, self.image_cutflow,
+                        getattr(self.cleaner, "cutflow", None)]:
+            if cutflow is not None and all(cutflow is not c for c in cutflows):
+                cutflows.append(cutflow)
+        return cutflows
+
+    def prepare_event_parallel(self, source, return_stub=False):
+        """same as `prepare_event` but distributes the events of `source` among
+        `n_jobs` worker processes. Every worker counts in its own copies of the
+        cutflows; their counts are merged into the cutflows of this instance
+        whenever a worker returns an event.
+
+        Note
+        ----
+        The workers are forked from the current process, so the calibrator, cleaner
+        and reconstructor don't need to be picklable -- the events and their results
+        do, though. Every worker makes its own `SubarrayPointing` unless this instance
+        has one already.
+        """
+
+        def tasks():
+            for event in source:
+                yield event, return_stub
+
+        cutflows = self.get_cutflows()
+        pool = multiprocessing.get_context("fork").Pool(
+            self.n_jobs, initializer=_init_worker, initargs=(self,))
+        try:
+            if self.ordered:
+                results = pool.imap(_prepare_in_worker, tasks(), self.chunksize)
+            else:
+                results = pool.imap_unordered(_prepare_in_worker, tasks(),
+                                              self.chunksize)
+
+            for prepared, counts in results:
+                merge_cutflow_counts(cutflows, counts)
+                yield from prepared
+        finally:
+            # if the caller stops iterating early, don't wait for the pending events
+            pool.terminate()
+            pool.join()
+
     def prepare_event(self, source, return_stub=False):
 
+        if self.n_jobs > 1:
+            yield from self.prepare_event_parallel(source, return_stub)
+            return
+
         for event in source:
 
             self.event_cutflow.count("noCuts")
@@ -117,46 +410,50 @@ class EventPreparer():
             hillas_dict = {}
             n_tels = {"tot": len(event.dl0.tels_with_data),
                       "LST": 0, "MST": 0, "SST": 0}
-            for tel_id in event.dl0.tels_with_data:
-                self.image_cutflow.count("noCuts")
-
-                camera = event.inst.subarray.tel[tel_id].camera
-
-                # can this be improved?
-                if tel_id not in tel_phi:
-                    tel_phi[tel_id] = az_to_phi(event.mc.tel[tel_id].azimuth_raw * u.rad)
-                    tel_theta[tel_id] = \
-                        alt_to_theta(event.mc.tel[tel_id].altitude_raw*u.rad)
-
-                    # the orientation of the camera (i.e. the pixel positions) needs to
-                    # be corrected
-                    camera.pix_x, camera.pix_y = \
-                        transform_pixel_position(camera.pix_x, camera.pix_y)
 
+            if self.pointing is None:
+                self.pointing = SubarrayPointing(event.inst.subarray)
+            tel_ids = self.pointing.update(event)
+            self.image_cutflow.count("noCuts", weight=len(tel_ids))
+
+            # collect the telescopes grouped by camera type, so that the gain channels
+            # of all images of the same camera type can be selected and the images be
+            # cleaned in one go
+            tel_ids_per_cam = OrderedDict()
+            for tel_id, camera, tel_type in zip(tel_ids.tolist(),
+                                                self.pointing.cameras[tel_ids],
+                                                self.pointing.tel_types[tel_ids]):
                 # count the current telescope according to its size
-                tel_type = event.inst.subarray.tel[tel_id].optics.tel_type
                 n_tels[tel_type] += 1
 
-                # the camera image as a 1D array
-                pmt_signal = event.dl1.tel[tel_id].image
+                tel_ids_per_cam.setdefault(camera.cam_id, []).append(tel_id)
 
-                pmt_signal = self.pick_gain_channel(pmt_signal, camera.cam_id)
+            # clean the images
+            cleaned = {}
+            for cam_id, cam_tel_ids in tel_ids_per_cam.items():
+                camera = self.pointing.cameras[cam_tel_ids[0]]
 
-                # clean the image
+                # the camera images as a 1D array each
+                pmt_signals = self.pick_gain_channels(
+                    [event.dl1.tel[tel_id].image for tel_id in cam_tel_ids], cam_id)
                 try:
                     with warnings.catch_warnings():
                         warnings.simplefilter("ignore")
-                        pmt_signal, new_geom = \
-                            self.cleaner.clean(pmt_signal.copy(), camera)
-
-                    if self.image_cutflow.cut("min pixel", pmt_signal) or \
-                       self.image_cutflow.cut("min charge", np.sum(pmt_signal)):
-                        continue
-
+                        cleaned.update(zip(cam_tel_ids, self.cleaner.clean_batch(
+                            pmt_signals, camera)))
                 except FileNotFoundError as e:
                     print(e)
                     continue
-                except EdgeEvent:
+
+            for tel_id in tel_ids.tolist():
+                # image not cleaned or rejected as edge event
+                if cleaned.get(tel_id) is None:
+                    continue
+
+                pmt_signal, new_geom = cleaned[tel_id]
+
+                if self.image_cutflow.cut("min pixel", pmt_signal) or \
+                   self.image_cutflow.cut("min charge", np.sum(pmt_signal)):
                     continue
 
                 # could this go into `hillas_parameters` ...?
@@ -240,11 +537,13 @@ class EventPreparer():
                     warnings.simplefilter("ignore")
                     # telescope loop done, now do the core fit
                     self.shower_reco.get_great_circles(
-                            hillas_dict, event.inst.subarray, tel_phi, tel_theta)
+                            hillas_dict, event.inst.subarray,
+                            self.pointing.phi, self.pointing.theta)
                     pos_fit, err_est_pos = self.shower_reco.fit_core_crosses()
                     dir_fit, err_est_dir = self.shower_reco.fit_origin_crosses()
                     h_max = self.shower_reco.fit_h_max(
-                            hillas_dict, event.inst.subarray, tel_phi, tel_theta)
+                            hillas_dict, event.inst.subarray,
+                            self.pointing.phi, self.pointing.theta)
             except Exception as e:
                 print(e)
                 if return_stub:
@@ -0,0 +1,248 @@
+"""in-process version of the wavelet filtering done by `mr_filter`
+
+`datapipe`'s `WaveletTransform` writes every image into a FITS file, calls the external
+`mr_filter` executable on it and reads the result back in. Here, the same starlet
+transform (isotropic undecimated wavelet transform with a B3-spline scaling function)
+and the hard k-sigma thresholding of its coefficients is done directly on numpy arrays.
+
+Only the subset of the `mr_filter` command line options we actually use is understood:
+
+    -K        suppress the last (smooth) scale -- i.e. set the background to zero
+    -k        remove isolated pixels after the filtering
+    -C1       detection of significant coefficients by k-sigma thresholding
+    -m1, -m3  Gaussian or Poisson+Gaussian noise model
+    -s..      the k of the k-sigma thresholds; comma separated, one per scale
+    -n..      number of scales (including the smooth one)
+
+This backend is experimental: its results have not been validated against stored
+reference outputs of `mr_filter` -- in particular the estimate of the Gaussian noise
+of the `-m3` noise model. Until they are, it is only selectable from the sandbox
+scripts (cf. `sandbox/compare_wavelet_backends.py`), not from the production ones.
+"""
+
+import numpy as np
+from scipy import ndimage
+
+from tino_cta.ImageCleaning import kill_isolpix_batch
+
+
+__all__ = ["StarletFilter", "parse_mrfilter_options", "starlet_transform"]
+
+
+# the B3-spline used as scaling function by the starlet transform
+b3_spline = np.array([1., 4., 6., 4., 1.]) / 16.
+
+# converts the median absolute deviation into the standard deviation of a Gaussian
+mad_to_sigma = 1 / 0.6745
+
+
+class UnsupportedOption(ValueError):
+    pass
+
+
+def parse_mrfilter_options(raw_option_string):
+    """translates a `mr_filter` command line into a dictionary of filter settings
+
+    Parameters
+    ----------
+    raw_option_string : string
+        the options for `mr_filter`, e.g. "-K -C1 -m3 -s2,2,3,3 -n4"
+
+    Returns
+    -------
+    options : dictionary
+        `n_scales`, `thresholds`, `noise_model`, `suppress_last_scale` and
+        `kill_isolated_pixels`
+
+    Raises
+    ------
+    UnsupportedOption
+        if the string contains options `mr_filter` knows but that are not
+        implemented here
+    """
+    options = {"n_scales": 4,
+               "thresholds": [3.],
+               "noise_model": 1,
+               "suppress_last_scale": False,
+               "kill_isolated_pixels": False}
+
+    for option in raw_option_string.split():
+        flag, value = option[:2], option[2:]
+        if flag == "-K":
+            options["suppress_last_scale"] = True
+        elif flag == "-k":
+            options["kill_isolated_pixels"] = True
+        elif flag == "-n":
+            options["n_scales"] = int(value)
+        elif flag == "-s":
+            options["thresholds"] = [float(s) for s in value.split(",")]
+        elif flag == "-m" and value in ["1", "3"]:
+            options["noise_model"] = int(value)
+        elif flag == "-C" and value == "1":
+            pass
+        else:
+            raise UnsupportedOption(
+                "mr_filter option '{}' not supported by the starlet backend"
+                .format(option))
+
+    return options
+
+
+def starlet_transform(image, n_scales):
+    """decomposes `image` into `n_scales - 1` wavelet planes and one smooth plane
+
+    Parameters
+    ----------
+    image : 2D or 3D array
+        the image to transform; for a stack of images (3D array), the transform is
+        only done along the last two axes, i.e. separately for every image
+    n_scales : integer
+        number of scales including the smooth one
+
+    Returns
+    -------
+    planes : 3D or 4D array
+        the wavelet planes with the smooth plane last; summing over the first axis
+        gives back the original image(s)
+    """
+    planes = np.empty((n_scales,) + image.shape)
+
+    smooth = image
+    for scale in range(n_scales - 1):
+        # "à trous": put 2**scale - 1 holes between the entries of the kernel
+        kernel = np.zeros(4 * 2**scale + 1)
+        kernel[::2**scale] = b3_spline
+
+        smoother = ndimage.convolve1d(smooth, kernel, axis=-2, mode="mirror")
+        smoother = ndimage.convolve1d(smoother, kernel, axis=-1, mode="mirror")
+
+        planes[scale] = smooth - smoother
+        smooth = smoother
+    planes[-1] = smooth
+
+    return planes
+
+
+noise_level_buffer = {}
+
+
+def starlet_noise_levels(n_scales):
+    """standard deviation of the wavelet coefficients on every scale for white
+    Gaussian noise with unit standard deviation
+
+    these follow from transforming a Dirac peak; the results get buffered
+    """
+    if n_scales not in noise_level_buffer:
+        size = 8 * 2**n_scales + 1
+        dirac = np.zeros((size, size))
+        dirac[size // 2, size // 2] = 1
+        planes = starlet_transform(dirac, n_scales)
+        noise_level_buffer[n_scales] = np.sqrt(np.sum(planes**2, axis=(-2, -1)))
+    return noise_level_buffer[n_scales]
+
+
+def anscombe_transform(image, gain=1., sigma=0., mean=0.):
+    """generalised Anscombe transform; turns Poisson + Gaussian noise into Gaussian
+    noise with unit standard deviation"""
+    arg = gain * image + 3 / 8 * gain**2 + sigma**2 - gain * mean
+    return 2 / gain * np.sqrt(np.clip(arg, 0, None))
+
+
+class StarletFilter:
+    """drop-in replacement for `datapipe`'s `WaveletTransform` that filters images
+    in memory instead of calling `mr_filter`"""
+
+    def clean_image(self, input_image, raw_option_string,
+                    noise_distribution=None, kill_isolated_pixels=False, **kwargs):
+        """filters `input_image` according to the `mr_filter` options in
+        `raw_option_string`
+
+        Parameters
+        ----------
+        input_image : 2D array
+            the rectangular image to filter; NaN entries mark pixels that don't
+            belong to the camera
+        raw_option_string : string
+            `mr_filter` command line options; cf. `parse_mrfilter_options`
+        noise_distribution : `EmpiricalDistribution`, optional (default: None)
+            the NaN pixels are filled with noise drawn from this distribution before
+            the transformation; if None, they are set to zero
+        kill_isolated_pixels : bool, optional (default: False)
+            if True, only keep the biggest island of the filtered image
+        kwargs
+            ignored -- only here to accept the arguments meant for `mr_filter`
+
+        Returns
+        -------
+        cleaned_image : 2D array
+            the filtered image; the pixels not belonging to the camera are set to zero
+        """
+        return self.clean_images([input_image], raw_option_string,
+                                 noise_distribution, kill_isolated_pixels)[0]
+
+    def clean_images(self, input_images, raw_option_string,
+                     noise_distribution=None, kill_isolated_pixels=False, **kwargs):
+        """same as `clean_image` but filters a whole stack of images of the same shape
+        at once; the noise level is still estimated separately for every image
+
+        Parameters
+        ----------
+        input_images : 3D array
+            the stack of rectangular images with shape `(n_images, ny, nx)`
+
+        Returns
+        -------
+        cleaned_images : 3D array
+            the filtered images
+        """
+        options = parse_mrfilter_options(raw_option_string)
+        n_scales = options["n_scales"]
+
+        images = np.array(input_images, dtype=float)
+        nan_mask = np.isnan(images)
+        if noise_distribution is not None:
+            images[nan_mask] = noise_distribution.rvs(size=np.count_nonzero(nan_mask))
+        else:
+            images[nan_mask] = 0
+
+        planes = starlet_transform(images, n_scales)
+        noise_levels = starlet_noise_levels(n_scales)[:-1]
+
+        # the Gaussian noise of every image, estimated from the median absolute
+        # deviation of the coefficients on the finest scale
+        finest = planes[0]
+        deviation = np.abs(finest - np.median(finest, axis=(-2, -1), keepdims=True))
+        sigma = np.median(deviation, axis=(-2, -1)) * mad_to_sigma / noise_levels[0]
+
+        # determine which coefficients are significant -- either on the planes
+        # themselves with the estimated noise or on the planes of the
+        # variance-stabilised images that have unit noise by construction; like
+        # `mr_filter`, the Gaussian part of the Poisson+Gaussian noise model is taken
+        # from the images with a gain of one
+        if options["noise_model"] == 3:
+            mean = np.median(images, axis=(-2, -1))
+            detection_planes = starlet_transform(
+                anscombe_transform(images, sigma=sigma[:, None, None],
+                                   mean=mean[:, None, None]), n_scales)
+            sigma = np.ones(len(images))
+        else:
+            detection_planes = planes
+
+        # if there are less thresholds than scales, repeat the last one
+        k_sigma = np.array(options["thresholds"][:n_scales - 1])
+        k_sigma = np.append(k_sigma, [k_sigma[-1]] * (n_scales - 1 - len(k_sigma)))
+
+        # one threshold per scale and image
+        thresholds = np.outer(k_sigma * noise_levels, sigma)
+        support = np.abs(detection_planes[:-1]) >= thresholds[..., None, None]
+
+        cleaned_images = np.sum(planes[:-1] * support, axis=0)
+        if not options["suppress_last_scale"]:
+            cleaned_images += planes[-1]
+
+        cleaned_images[nan_mask] = 0
+
+        if kill_isolated_pixels or options["kill_isolated_pixels"]:
+            kill_isolpix_batch(cleaned_images, out=cleaned_images)
+
+        return cleaned_images
@@ -0,0 +1,144 @@
+import signal
+from contextlib import contextmanager
+
+import numpy as np
+import tables as tb
+
+
+__all__ = ["create_table", "ChunkedTableWriter", "sigint_deferred"]
+
+
+@contextmanager
+def sigint_deferred():
+    """blocks SIGINT for the duration of the block; a Ctrl+C pressed in between is
+    delivered at its end, so that its handler never runs in the middle of a write"""
+    old_mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT})
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, old_mask)
+
+
+def create_table(h5file, where, name, description, complib="blosc:zstd",
+                 complevel=0, chunkshape=None, **kwargs):
+    """creates a PyTables table with the given compression and chunk settings
+
+    Parameters
+    ----------
+    h5file : tables.File
+        the open file to create the table in
+    where, name : strings
+        the parent group and the name of the new table
+    description : tables.IsDescription subclass or numpy dtype
+        the layout of the table
+    complib : string (default: "blosc:zstd")
+        compression library; any name `tables.Filters` understands
+    complevel : integer (default: 0)
+        compression level from 0 (no compression) to 9
+    chunkshape : integer, optional (default: None)
+        number of rows per HDF5 chunk; if None, PyTables guesses one
+    kwargs
+        further arguments for `h5file.create_table`, e.g. `expectedrows`
+
+    Returns
+    -------
+    table : tables.Table
+    """
+    filters = tb.Filters(complevel=complevel, complib=complib) if complevel else None
+    if chunkshape is not None:
+        chunkshape = (chunkshape,)
+    return h5file.create_table(where, name, description,
+                               filters=filters, chunkshape=chunkshape, **kwargs)
+
+
+class ChunkedTableWriter:
+    """collects the rows for a PyTables table in a preallocated numpy structured array
+    and writes them to the table in chunks instead of row by row
+
+    Parameters
+    ----------
+    table : tables.Table
+        the table to write into; the buffer has the same dtype, so the layout of the
+        table stays the same
+    chunk_size : integer (default: 10000)
+        number of rows collected before they are written to the table
+    """
+
+    def __init__(self, table, chunk_size=10000):
+        self.table = table
+        self.chunk_size = chunk_size
+        self.buffer = np.zeros(chunk_size, dtype=table.dtype)
+        self.n_rows = 0
+        # the `dflt` of every column, for the columns a row doesn't give
+        self.defaults = {name: table.coldflts[name]
+                         for name in self.buffer.dtype.names}
+
+    def __len__(self):
+        return self.n_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def append(self, row):
+        """adds one row to the buffer
+
+        Parameters
+        ----------
+        row : dictionary or sequence
+            the values of the row, either mapping the column names to their values
+            or in the order of the columns; columns missing in a dictionary get their
+            default value
+        """
+        if isinstance(row, dict):
+            row = tuple(row.get(name, default) for name, default in
+                        self.defaults.items())
+        self.buffer[self.n_rows] = tuple(row)
+        self.n_rows += 1
+        if self.n_rows == self.chunk_size:
+            self.flush()
+
+    def append_columns(self, **columns):
+        """adds a block of rows given as one array (or scalar) per column; scalars
+        are broadcast to the length of the other columns
+
+        Parameters
+        ----------
+        columns : arrays or scalars
+            the values of every column, keyed by the column names; the columns not
+            given get their default value
+        """
+        n_new = max(np.size(values) for values in columns.values())
+        start = 0
+        while start < n_new:
+            n_take = min(n_new - start, self.chunk_size - self.n_rows)
+            block = self.buffer[self.n_rows:self.n_rows + n_take]
+            for name, default in self.defaults.items():
+                if name not in columns:
+                    block[name] = default
+                    continue
+                values = columns[name]
+                block[name] = values if np.isscalar(values) \
+                    else np.asarray(values)[start:start + n_take]
+            self.n_rows += n_take
+            start += n_take
+            if self.n_rows == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """writes the buffered rows to the table and empties the buffer; Ctrl+C is
+        deferred until this is done"""
+        with sigint_deferred():
+            if self.n_rows:
+                self.table.append(self.buffer[:self.n_rows])
+                self.n_rows = 0
+            self.table.flush()
+
+    def checkpoint(self):
+        """writes the buffered rows and flushes the whole HDF5 file, so that everything
+        written up to here survives a crash of the job"""
+        with sigint_deferred():
+            self.flush()
+            self.table._v_file.flush()
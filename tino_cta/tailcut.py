@@ -0,0 +1,157 @@
+"""tailcut cleaning and island selection directly on the 1D camera images
+
+The neighbourhood of the pixels of a camera is kept as a sparse adjacency matrix, so
+that "has a neighbour that ..." becomes a sparse matrix product and the islands of an
+image are the connected components of the adjacency graph restricted to its selected
+pixels. Everything works on whole stacks of images of the same camera at once and no
+conversion to a rectangular grid is needed.
+
+The selection follows ctapipe's `tailcuts_clean` and `dilate`, the island selection
+`ImageCleaning.kill_isolpix`.
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+
+__all__ = ["get_neighbour_matrix", "tailcuts_clean_batch", "dilate_batch",
+           "largest_island_batch"]
+
+
+def get_neighbour_matrix(camera):
+    """sparse adjacency matrix of the pixels of `camera`
+
+    Parameters
+    ----------
+    camera : ctapipe CameraGeometry object
+        the camera geometry object
+
+    Returns
+    -------
+    neighbour_matrix : `scipy.sparse.csr_matrix`
+        `n_pix × n_pix` matrix with a 1 for every pair of neighbouring pixels
+
+    Note
+    ----
+    `neighbour_matrix` is stored as a member of `camera`, since the same camera
+    geometry will show up many times
+    """
+    if not hasattr(camera, "neighbour_matrix"):
+        n_pix = len(camera.neighbors)
+        rows = np.repeat(np.arange(n_pix), [len(neigh) for neigh in camera.neighbors])
+        cols = np.concatenate([np.asarray(neigh, dtype=int)
+                               for neigh in camera.neighbors])
+        camera.neighbour_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n_pix, n_pix))
+    return camera.neighbour_matrix
+
+
+def count_neighbours(neighbour_matrix, masks):
+    """number of neighbours within `masks` of every pixel
+
+    Parameters
+    ----------
+    neighbour_matrix : sparse matrix
+        cf. `get_neighbour_matrix`
+    masks : 2D boolean array
+        one row of selected pixels per image
+
+    Returns
+    -------
+    counts : 2D integer array
+        same shape as `masks`
+    """
+    return neighbour_matrix.dot(masks.T.astype(np.int32)).T
+
+
+def tailcuts_clean_batch(camera, images, picture_thresh=7, boundary_thresh=5):
+    """two-level tailcut selection of a stack of images; same as calling ctapipe's
+    `tailcuts_clean` on every image: pixels above `picture_thresh` with a neighbour
+    above `boundary_thresh` and pixels above `boundary_thresh` with a neighbour above
+    `picture_thresh` are kept
+
+    Parameters
+    ----------
+    camera : ctapipe CameraGeometry object
+        the camera geometry of all images
+    images : 2D array
+        one 1D camera image per row
+    picture_thresh, boundary_thresh : floats
+        the two thresholds
+
+    Returns
+    -------
+    masks : 2D boolean array
+        the selected pixels of every image
+    """
+    neighbour_matrix = get_neighbour_matrix(camera)
+    images = np.asarray(images)
+
+    above_picture = images >= picture_thresh
+    above_boundary = images >= boundary_thresh
+
+    with_picture_neighbours = count_neighbours(neighbour_matrix, above_picture) > 0
+    with_boundary_neighbours = count_neighbours(neighbour_matrix, above_boundary) > 0
+    return (above_boundary & with_picture_neighbours) | \
+        (above_picture & with_boundary_neighbours)
+
+
+def dilate_batch(camera, masks):
+    """adds the neighbours of the selected pixels to every mask in `masks`; same as
+    ctapipe's `dilate` on every mask"""
+    return masks | (count_neighbours(get_neighbour_matrix(camera), masks) > 0)
+
+
+def largest_island_batch(camera, images, threshold=.2):
+    """removes all islands but the one with the largest sum of signal from every
+    image; same as `ImageCleaning.kill_isolpix` on the rectangular version of every
+    image with `neighbours` covering the direct neighbours of a pixel
+
+    Parameters
+    ----------
+    camera : ctapipe CameraGeometry object
+        the camera geometry of all images
+    images : 2D array
+        one 1D camera image per row
+    threshold : float, optional (default: 0.2)
+        pixels with a signal below this value are set to zero before the islands are
+        identified
+
+    Returns
+    -------
+    filtered_images : 2D array
+        the images with only their largest island remaining
+    """
+    images = np.array(images, dtype=float)
+    images[images < threshold] = 0
+    if images.size == 0:
+        return images
+
+    n_images, n_pix = images.shape
+    selected = images > 0
+
+    # only keep the edges of the adjacency graph between selected pixels of the same
+    # image; every pixel of every image becomes its own node of a combined graph
+    neighbour_matrix = get_neighbour_matrix(camera).tocoo()
+    edge_selected = selected[:, neighbour_matrix.row] & selected[:, neighbour_matrix.col]
+    image_id, edge_id = np.nonzero(edge_selected)
+    offset = image_id * n_pix
+    graph = sparse.csr_matrix(
+        (np.ones(len(edge_id), dtype=np.int8),
+         (offset + neighbour_matrix.row[edge_id], offset + neighbour_matrix.col[edge_id])),
+        shape=(images.size, images.size))
+
+    n_islands, island_id = connected_components(graph, directed=False)
+
+    # the sum of every island and the largest sum per image; unselected pixels are
+    # islands of their own with a sum of zero
+    island_sum = np.bincount(island_id, weights=images.ravel(), minlength=n_islands)
+    island_image = np.empty(n_islands, dtype=int)
+    island_image[island_id] = np.repeat(np.arange(n_images), n_pix)
+    max_sum = np.zeros(n_images)
+    np.maximum.at(max_sum, island_image, island_sum)
+
+    remove_pixel = (island_sum < max_sum[island_image])[island_id]
+    images[remove_pixel.reshape(images.shape)] = 0
+    return images
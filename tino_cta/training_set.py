@@ -0,0 +1,188 @@
+"""reads the feature tables written by `write_feature_table.py` into the contiguous
+arrays the random forests are trained on
+
+The tables are read in chunks of whole rows straight into a preallocated 2D array, so
+that no Python object is created per image. Optionally, only a random subsample of the
+rows is kept and the result is cached as a `.npy` file that later runs map into memory
+instead of reading the HDF5 file again.
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import tables as tb
+
+
+__all__ = ["read_feature_table", "load_training_set"]
+
+
+# the names of the tables in the feature files for the different camera types
+feature_table_names = {"LSTCam": "feature_events_lst",
+                       "NectarCam": "feature_events_nec",
+                       "DigiCam": "feature_events_dig"}
+
+
+def subsample_mask(n_rows, max_rows=None, fraction=None, seed=None):
+    """randomly selects the rows to keep of a table with `n_rows` rows
+
+    Parameters
+    ----------
+    n_rows : integer
+        number of rows in the table
+    max_rows : integer, optional (default: None)
+        keep at most this many rows
+    fraction : float, optional (default: None)
+        keep this fraction of the rows
+    seed : integer, optional (default: None)
+        seed of the random selection; with the same seed, the same rows are selected
+        from every column of the table
+
+    Returns
+    -------
+    mask : boolean array or None
+        True for the selected rows; None if all rows are kept
+    """
+    n_keep = n_rows
+    if fraction is not None:
+        n_keep = int(round(n_keep * fraction))
+    if max_rows is not None:
+        n_keep = min(n_keep, max_rows)
+    if n_keep >= n_rows:
+        return None
+
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[np.random.RandomState(seed).choice(n_rows, n_keep, replace=False)] = True
+    return mask
+
+
+def read_feature_table(table, columns, dtype=np.float32, mask=None, out=None,
+                       chunk_size=100000):
+    """reads `columns` of `table` into one 2D array with one row per table row
+
+    Parameters
+    ----------
+    table : tables.Table
+        the table to read
+    columns : list of strings
+        the names of the columns, in the order they should have in the array
+    dtype : numpy dtype (default: np.float32)
+        type of the returned array
+    mask : boolean array, optional (default: None)
+        only read the rows where `mask` is True; cf. `subsample_mask`
+    out : 2D array, optional (default: None)
+        array to write the result into; needs the shape `(n_selected_rows,
+        len(columns))`
+    chunk_size : integer (default: 100000)
+        number of table rows read at once
+
+    Returns
+    -------
+    features : 2D array
+        the values of the selected rows, C-contiguous
+    """
+    n_selected = table.nrows if mask is None else np.count_nonzero(mask)
+    if out is None:
+        out = np.empty((n_selected, len(columns)), dtype=dtype)
+
+    filled = 0
+    for start in range(0, table.nrows, chunk_size):
+        chunk = table.read(start, start + chunk_size)
+        if mask is not None:
+            chunk = chunk[mask[start:start + chunk_size]]
+        for i, name in enumerate(columns):
+            out[filled:filled + len(chunk), i] = chunk[name]
+        filled += len(chunk)
+
+    return out
+
+
+def get_cache_path(cache_dir, table, columns, dtype, max_rows, fraction, seed):
+    """path of the cache file of one selection of a table; the name contains a hash
+    of everything the content depends on, including the size and modification time
+    of the HDF5 file so that the cache of a rewritten file is not used anymore"""
+    filename = os.path.abspath(table._v_file.filename)
+    stat = os.stat(filename)
+    key = repr((filename, stat.st_size, stat.st_mtime, table._v_pathname,
+                list(columns), np.dtype(dtype).str, max_rows, fraction, seed))
+    return os.path.join(cache_dir, "{}_{}.npy".format(
+        table.name, hashlib.sha1(key.encode()).hexdigest()))
+
+
+def load_feature_table(table, columns, dtype=np.float32, max_rows=None,
+                       fraction=None, seed=None, cache_dir=None, chunk_size=100000):
+    """same as `read_feature_table` with the row selection of `subsample_mask`; if
+    `cache_dir` is given, the result is taken from (or put into) a `.npy` file in
+    there and returned as a read-only memory map
+    """
+    if cache_dir is not None:
+        path = get_cache_path(cache_dir, table, columns, dtype,
+                              max_rows, fraction, seed)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode="r")
+
+    mask = subsample_mask(table.nrows, max_rows, fraction, seed)
+    if cache_dir is None:
+        return read_feature_table(table, columns, dtype, mask, chunk_size=chunk_size)
+
+    # fill the memory map directly and only move it into place once it is complete
+    # so that concurrent jobs never read a half-written file
+    n_selected = table.nrows if mask is None else int(np.count_nonzero(mask))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype,
+                                    shape=(n_selected, len(columns)))
+    read_feature_table(table, columns, dtype, mask, out, chunk_size)
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r")
+
+
+def load_training_set(filename, feature_names, target_name=None, cam_ids=None,
+                      max_rows=None, fraction=None, seed=None, cache_dir=None,
+                      chunk_size=100000):
+    """reads the features (and optionally a target like the MC energy) of the images
+    of all camera types in a feature file
+
+    Parameters
+    ----------
+    filename : string
+        path of the HDF5 file written by `write_feature_table.py`
+    feature_names : list of strings
+        names of the feature columns, in the order the models expect them
+    target_name : string, optional (default: None)
+        name of a further column to return separately, e.g. "MC_Energy"; it is read
+        in double precision
+    cam_ids : list of strings, optional (default: None)
+        the camera types to read; all in `feature_table_names` if None
+    max_rows, fraction, seed
+        random subsampling of the images of every camera type; cf. `subsample_mask`
+    cache_dir : string, optional (default: None)
+        directory for the memory-mapped cache files; no caching if None
+    chunk_size : integer (default: 100000)
+        number of table rows read at once
+
+    Returns
+    -------
+    features : dictionary of 2D float32 arrays
+        the features per `cam_id`, one row per image
+    targets : dictionary of 1D arrays
+        the target column per `cam_id`; only returned if `target_name` is given
+    """
+    cam_ids = cam_ids or list(feature_table_names)
+
+    features, targets = {}, {}
+    with tb.open_file(filename, mode="r") as feature_file:
+        for cam_id in cam_ids:
+            table = feature_file.get_node("/", feature_table_names[cam_id])
+            kwargs = dict(max_rows=max_rows, fraction=fraction, seed=seed,
+                          cache_dir=cache_dir, chunk_size=chunk_size)
+            features[cam_id] = load_feature_table(table, feature_names, **kwargs)
+            if target_name is not None:
+                targets[cam_id] = load_feature_table(
+                    table, [target_name], dtype=np.float64, **kwargs)[:, 0]
+
+    if target_name is None:
+        return features
+    return features, targets